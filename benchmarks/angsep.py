@@ -0,0 +1,74 @@
+"""Compare the scalar utils.angsep/rasep path against the batch versions
+
+usage: python benchmarks/angsep.py [number of sources]
+"""
+import sys
+import timeit
+
+from pathlib import Path
+
+import numpy as np
+
+from astropy.coordinates import Angle
+
+# the checkout these scripts belong to is measured, never an installed pyfitsutils
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pyfitsutils import settings, utils
+
+
+def sources(n: int, seed: int = 0):
+    """n random sources within a few arcsec of settings.TARGET, in radians"""
+    rng = np.random.default_rng(seed)
+    ra, _, dec, _ = utils.radians(settings.TARGET)
+    return (
+        ra + rng.normal(0, 1e-5, n),
+        np.abs(rng.normal(0, 1e-7, n)),
+        dec + rng.normal(0, 1e-5, n),
+        np.abs(rng.normal(0, 1e-7, n)),
+    )
+
+
+def scalar_angsep(ra, ra_err, dec, dec_err):
+    t = settings.TARGET
+    return [
+        utils.angsep(
+            t["ra"], t["ra_err"], t["dec"], t["dec_err"],
+            Angle(ra[i], "rad"), Angle(ra_err[i], "rad"), Angle(dec[i], "rad"), Angle(dec_err[i], "rad"),
+        ) for i in range(len(ra))
+    ]
+
+
+def scalar_rasep(ra, ra_err, dec, dec_err):
+    t = settings.TARGET
+    return [utils.rasep(t["ra"], t["ra_err"], Angle(ra[i], "rad"), Angle(ra_err[i], "rad")) for i in range(len(ra))]
+
+
+def batch_angsep(ra, ra_err, dec, dec_err):
+    return utils.angsep_batch(*utils.radians(settings.TARGET), ra, ra_err, dec, dec_err)
+
+
+def batch_rasep(ra, ra_err, dec, dec_err):
+    target_ra, target_ra_err, _, _ = utils.radians(settings.TARGET)
+    return utils.rasep_batch(target_ra, target_ra_err, ra, ra_err)
+
+
+def main(n: int = 1000):
+    data = sources(n)
+    for name, scalar, batch in [("angsep", scalar_angsep, batch_angsep), ("rasep", scalar_rasep, batch_rasep)]:
+        t_scalar = min(timeit.repeat(lambda: scalar(*data), number=1, repeat=3))
+        t_batch = min(timeit.repeat(lambda: batch(*data), number=1, repeat=3))
+        print(f"{name}: {n} sources, scalar {t_scalar*1e3:.2f} ms, batch {t_batch*1e3:.3f} ms, x{t_scalar/t_batch:.0f}")
+
+    # precision against astropy, which also uses the Vincenty formula
+    from astropy.coordinates import angular_separation
+    ra, _, dec, _ = data
+    target_ra, _, target_dec, _ = utils.radians(settings.TARGET)
+    reference = angular_separation(target_ra, target_dec, ra, dec)
+    scalar = np.array([sep[0].rad for sep in scalar_angsep(*data)])
+    batch = batch_angsep(*data)[0]
+    print(f"max relative error: scalar {np.max(np.abs(scalar - reference) / reference):.2e}, batch {np.max(np.abs(batch - reference) / reference):.2e}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
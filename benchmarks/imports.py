@@ -0,0 +1,47 @@
+"""Measure the import time of pyfitsutils modules with python -X importtime
+
+usage: python benchmarks/imports.py [module ...] [--top N]
+
+Each module is imported in a fresh interpreter, the total time and the slowest imports it pulls are
+printed. Defaults to the command line entry point (pyfitsutils.core) and the drawing module.
+"""
+import os
+import subprocess
+import sys
+
+from pathlib import Path
+
+# the checkout these scripts belong to is measured, never an installed pyfitsutils
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def importtime(module: str) -> list[tuple[int, str]]:
+    """Return the (cumulative microseconds, module) of every import done by importing module"""
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [str(ROOT), os.environ.get("PYTHONPATH")]))}
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True, check=True, env=env)
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times.append((int(cumulative), name.strip()))
+    return times
+
+
+def main(modules: list[str], top: int = 10):
+    for module in modules:
+        times = importtime(module)
+        total = next(t for t, name in reversed(times) if name == module)
+        print(f"{module}: {total / 1e3:.0f} ms")
+        for t, name in sorted(times, reverse=True)[1:top + 1]:
+            print(f"  {t / 1e3:8.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    top = 10
+    if "--top" in args:
+        i = args.index("--top")
+        top = int(args[i + 1])
+        del args[i:i + 2]
+    main(args or ["pyfitsutils.core", "pyfitsutils.draw"], top)
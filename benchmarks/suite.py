@@ -0,0 +1,239 @@
+"""Time ingestion, merge, csv, angular separation and rendering on synthetic data
+
+usage: python benchmarks/suite.py [--epochs N] [--sources N] [--repeat N] [--only NAME,...] [--output results.json] [--compare old.json]
+
+Data is generated by synthetic.py in a temporary folder, only the data the selected benchmarks need.
+Each benchmark keeps the best of --repeat runs, results are saved as json in results/ (with the
+commit they ran on) so two commits can be compared with --compare, which prints the ratio of every
+common benchmark.
+"""
+import argparse
+import functools
+import json
+import logging
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from pathlib import Path
+
+import numpy as np
+
+# the checkout these scripts belong to is measured, never an installed pyfitsutils
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import synthetic
+
+RESULTS = Path(__file__).parent / "results"
+
+
+def commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True, cwd=Path(__file__).parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def timed(function, repeat: int) -> dict:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    # the first run is the cold one (disk caches empty, files not in the page cache yet)
+    return {"seconds": min(times), "first": times[0], "runs": times}
+
+
+class Inputs:
+    """Synthetic data of the benchmarks in folder, generated on first use so --only pays for what it runs"""
+
+    def __init__(self, folder: Path, epochs: int, sources: int):
+        self.folder = folder
+        self.epochs = epochs
+        self.sources = sources
+        self.n_sources = epochs * len(synthetic.BANDS) * sources
+
+    @functools.cached_property
+    def positions(self) -> dict:
+        return synthetic.write_fit_files(self.folder / "fits", self.epochs, list(synthetic.BANDS), self.sources)
+
+    @functools.cached_property
+    def fits(self) -> Path:
+        self.positions # the fit files are written with their positions
+        return self.folder / "fits"
+
+    @functools.cached_property
+    def fit_dict(self) -> dict:
+        from pyfitsutils.fits import Fit
+        return Fit.folder2dict(self.fits)
+
+    @functools.cached_property
+    def fit_catalog(self):
+        from pyfitsutils.fits import Fit
+        return Fit.folder2catalog(self.fits, workers=1)
+
+    @functools.cached_property
+    def annotated(self):
+        from pyfitsutils.fits import Fit
+        annotated = Fit.folder2catalog(self.fits, workers=1)
+        for _, _, group in annotated.groups():
+            group["is_main"] = np.arange(len(group)) == 0
+        return annotated
+
+    @functools.cached_property
+    def annotated_dict(self) -> dict:
+        return self.annotated.to_dict()
+
+    @property
+    def out_csv(self) -> Path:
+        return self.folder / "out.csv"
+
+    @functools.cached_property
+    def csv(self) -> Path:
+        from pyfitsutils.fits import Fit
+        Fit.catalog2csv(self.fit_catalog, self.folder / "catalog.csv")
+        return self.folder / "catalog.csv"
+
+    @functools.cached_property
+    def draw_groups(self) -> list:
+        """(date, band, sources) of a few epochs with their images, caches start empty so the first run is the cold one"""
+        from pyfitsutils import draw, settings
+        from pyfitsutils.draw import contours, cutouts
+
+        epochs = 3
+        synthetic.write_images(self.folder / "images", {key: value for key, value in self.positions.items() if key[0] in synthetic.dates(epochs)})
+        synthetic.write_rms_csv(self.folder / "rms.csv", epochs)
+        contours.cache.folder = self.folder / "cache" / "contours"
+        cutouts.cache.folder = self.folder / "cache" / "cutouts"
+        import matplotlib
+        matplotlib.use("Agg")
+        settings.LIST_DICT_SHEET.clear() # init appends a sheet per rms csv
+        draw.init([self.folder / "rms.csv"])
+        return [(date, band, sources) for date, band, sources in self.fit_catalog.groups() if date.date() in synthetic.dates(epochs)]
+
+
+def csv_roundtrip_dict(inputs: Inputs):
+    from pyfitsutils.fits import Fit
+    fit_dict = inputs.fit_dict
+    def run():
+        Fit.dict2csv(fit_dict, inputs.folder / "dict.csv")
+        Fit.csv2dict(inputs.folder / "dict.csv")
+    return run, inputs.n_sources
+
+
+def angsep_scalar(inputs: Inputs):
+    from astropy.coordinates import Angle
+    from pyfitsutils import settings, utils
+    angles = [utils.radians(row) for row in inputs.fit_catalog.rows[:1000]] # the scalar version is slow, time it on a sample
+    t = [settings.TARGET[key] for key in ("ra", "ra_err", "dec", "dec_err")]
+    def run():
+        for source in angles:
+            utils.angsep(*t, *(Angle(x, "rad") for x in source))
+    return run, len(angles)
+
+
+def angsep_batch(inputs: Inputs):
+    from pyfitsutils import settings, utils
+    target, rows = utils.radians(settings.TARGET), inputs.fit_catalog.rows
+    return (lambda: utils.angsep_batch(*target, *utils.radians(rows))), len(rows)
+
+
+def render(with_contours: bool):
+    def setup(inputs: Inputs):
+        from pyfitsutils import draw
+        import matplotlib.pyplot as plt
+        groups = inputs.draw_groups
+        def run():
+            for date, band, sources in groups:
+                fig = draw.draw_sources(date, band, sources, inputs.folder / "images", inputs.folder, with_contours, False, 0)
+                fig.canvas.draw()
+                plt.close(fig)
+        return run, len(groups)
+    return setup
+
+
+def fits_benchmark(method: str, *inputs_names: str, **kwargs):
+    """Benchmark of Fit.method called with the named inputs, over the synthetic sources"""
+    def setup(inputs: Inputs):
+        from pyfitsutils.fits import Fit
+        args = [getattr(inputs, name) for name in inputs_names]
+        return (lambda: getattr(Fit, method)(*args, **kwargs)), inputs.n_sources
+    return setup
+
+
+# name: setup(inputs) returning (function, items processed)
+BENCHMARKS = {
+    "folder2dict": fits_benchmark("folder2dict", "fits"),
+    "folder2catalog": fits_benchmark("folder2catalog", "fits", workers=1),
+    "folder2catalog_parallel": fits_benchmark("folder2catalog", "fits"),
+    "merge_dicts": fits_benchmark("merge_dicts", "fit_dict", "annotated_dict"),
+    "merge_catalogs": fits_benchmark("merge_catalogs", "fit_catalog", "annotated"),
+    "csv_write": fits_benchmark("catalog2csv", "fit_catalog", "out_csv"),
+    "csv_read": fits_benchmark("csv2catalog", "csv"),
+    "csv_roundtrip_dict": csv_roundtrip_dict,
+    "angsep_scalar": angsep_scalar,
+    "angsep_batch": angsep_batch,
+    "draw_sources": render(False),
+    "draw_sources_contours": render(True),
+}
+
+
+def compare(results: dict, path: Path):
+    old = json.loads(path.read_text())
+    print(f"\n{old['commit']} -> {results['commit']}")
+    for name, result in results["benchmarks"].items():
+        if name in old["benchmarks"] and "seconds" in result and "seconds" in old["benchmarks"][name]:
+            before, after = old["benchmarks"][name]["seconds"], result["seconds"]
+            print(f"{name:28s} {before:10.4f}s {after:10.4f}s  x{before / after:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--epochs", type=int, default=50)
+    parser.add_argument("--sources", type=int, default=3, help="sources per (date, band)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", help="comma separated benchmarks to run")
+    parser.add_argument("--output", type=Path, help="json file of the results (default: results/benchmark-<commit>.json next to this script)")
+    parser.add_argument("--compare", type=Path, help="json results of another run to compare with")
+    args = parser.parse_args()
+    names = args.only.split(",") if args.only else list(BENCHMARKS)
+    unknown = set(names) - BENCHMARKS.keys()
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+    logging.getLogger().setLevel(logging.WARNING) # the per file logs would drown the results
+
+    results = {
+        "commit": commit(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "params": {"epochs": args.epochs, "sources": args.sources, "repeat": args.repeat},
+        "benchmarks": {},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        inputs = Inputs(Path(tmp), args.epochs, args.sources)
+        for name in names:
+            try:
+                function, n = BENCHMARKS[name](inputs) # generates the data this benchmark needs
+                result = timed(function, args.repeat)
+            except Exception as e: # e.g. no LaTeX for the figures, keep the other results
+                result = {"error": f"{type(e).__name__}: {e}"}
+                print(f"{name:28s} failed: {result['error']}", file=sys.stderr)
+            else:
+                result["items"] = n
+                print(f"{name:28s} {result['seconds']:10.4f}s  {n / result['seconds']:12.0f} items/s")
+            results["benchmarks"][name] = result
+
+    output = args.output or RESULTS / f"benchmark-{results['commit']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2) + "\n")
+    print(f"Results saved to {output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
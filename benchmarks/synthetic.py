@@ -0,0 +1,128 @@
+"""Synthetic fit files, FITS images and rms sheets around settings.TARGET, for benchmarks
+
+usage: python benchmarks/synthetic.py folder [--epochs N] [--bands L,C,X] [--sources N] [--images] [--size PIXELS]
+
+Fit files are written in the format Fit.block2source_dict parses, with one beam per file. Images are
+named like the real ones ({date}_{band}band_robust0.fits) and have a SIN projection centered on the
+target, with the sources of the fit files drawn as gaussians over noise.
+"""
+import argparse
+import datetime
+import random
+import sys
+
+from pathlib import Path
+
+import numpy as np
+
+# the checkout these scripts belong to is measured, never an installed pyfitsutils
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pyfitsutils import settings
+
+# band: frequency (GHz)
+BANDS = {"L": 1.4, "C": 5.0, "X": 8.4, "Ku": 14.9, "K": 22.4}
+FIRST_DATE = datetime.date(1999, 6, 7)
+PIXEL_SCALE = 0.05 / 3600 # degrees
+RMS = 1e-5 # Jy/beam
+
+
+def dates(epochs: int) -> list[datetime.date]:
+    return [FIRST_DATE + datetime.timedelta(days=i) for i in range(epochs)]
+
+
+def sexagesimal(value: float) -> tuple[int, int, float]:
+    d, rest = divmod(abs(value) * 3600, 3600)
+    m, s = divmod(rest, 60)
+    return int(d), int(m), s
+
+
+def fit_block(k: int, ra: float, dec: float, beam: tuple[float, float], freq: float, rng: random.Random) -> str:
+    h, m, s = sexagesimal(ra / 15)
+    d, dm, ds = sexagesimal(dec)
+    unit = rng.choice(["mJy", "uJy"])
+    return (
+        f"Fit on XTE component {k}\n"
+        f"--- ra: {h:02d}:{m:02d}:{s:08.5f} +/- {rng.uniform(0.0001, 0.001):.5f} s\n"
+        f"--- ra: {rng.uniform(0, 1024):.1f} +/- 0.1 pixels\n"
+        f"--- dec: {'-' if dec < 0 else ''}{d:02d}.{dm:02d}.{ds:07.4f} +/- {rng.uniform(0.001, 0.01):.4f} arcsec\n"
+        f"--- dec: {rng.uniform(0, 1024):.1f} +/- 0.1 pixels\n"
+        "Clean beam size ---\n"
+        f"--- major axis FWHM: {beam[0]:.3f} arcsec\n"
+        f"--- minor axis FWHM: {beam[1]:.3f} arcsec\n"
+        f"--- Integrated: {rng.uniform(0.1, 50):.3f} +/- {rng.uniform(0.01, 1):.3f} {unit}\n"
+        f"--- frequency: {freq} GHz\n"
+    )
+
+
+def write_fit_files(folder: Path, epochs: int = 10, bands: list[str] = list(BANDS), sources: int = 3, seed: int = 0) -> dict:
+    """Write one fit file per (date, band) with sources components near the target, return their positions"""
+    folder.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed)
+    target_ra, target_dec = settings.TARGET["ra"].deg, settings.TARGET["dec"].deg
+    positions = {}
+    for date in dates(epochs):
+        for band in bands:
+            beam = (rng.uniform(0.1, 3), rng.uniform(0.1, 1))
+            radius = settings.DICT_RADIUS[f"{band}band"] / 2
+            blocks = []
+            for k in range(sources):
+                ra = target_ra + rng.uniform(-radius, radius)
+                dec = target_dec + rng.uniform(-radius, radius)
+                positions.setdefault((date, band), []).append((ra, dec))
+                blocks.append(fit_block(k, ra, dec, beam, BANDS[band], rng))
+            with open(folder / f"xte_{date.strftime('%d%b%Y').lower()}_{band}band.txt", "w") as f:
+                f.write("header\n" + "".join(blocks))
+    return positions
+
+
+def write_image(path: Path, positions: list[tuple[float, float]], size: int = 512, seed: int = 0):
+    """Write a 4 axes (ra, dec, freq, stokes) FITS image centered on the target with gaussian sources"""
+    from astropy.io import fits
+    from astropy.wcs import WCS
+
+    wcs = WCS(naxis=4)
+    wcs.wcs.ctype = ["RA---SIN", "DEC--SIN", "FREQ", "STOKES"]
+    wcs.wcs.crval = [settings.TARGET["ra"].deg, settings.TARGET["dec"].deg, 1e9, 1]
+    wcs.wcs.crpix = [size / 2 + 1, size / 2 + 1, 1, 1]
+    wcs.wcs.cdelt = [-PIXEL_SCALE, PIXEL_SCALE, 1e6, 1]
+    wcs.wcs.cunit = ["deg", "deg", "Hz", ""]
+
+    rng = np.random.default_rng(seed)
+    data = rng.normal(0, RMS, (size, size))
+    y, x = np.mgrid[:size, :size]
+    for ra, dec in positions:
+        px, py = wcs.celestial.world_to_pixel_values(ra, dec)
+        data += 100 * RMS * np.exp(-((x - px)**2 + (y - py)**2) / (2 * 3.0**2))
+    header = wcs.to_header()
+    header["BUNIT"] = "JY/BEAM"
+    fits.PrimaryHDU(data[np.newaxis, np.newaxis].astype(np.float32), header=header).writeto(path, overwrite=True)
+
+
+def write_images(folder: Path, positions: dict, size: int = 512):
+    folder.mkdir(parents=True, exist_ok=True)
+    for i, ((date, band), sources) in enumerate(sorted(positions.items())):
+        write_image(folder / f"{date.strftime('%d%b%Y').lower()}_{band}band_robust0.fits", sources, size, seed=i)
+
+
+def write_rms_csv(path: Path, epochs: int):
+    """Write the min, max and rms values of every band for each date, in the columns draw.init reads"""
+    with open(path, "w") as f:
+        for date in dates(epochs):
+            f.write(",".join(["xte", date.strftime("%d/%m/%Y"), "", ""] + [f"{-RMS},{100 * RMS},{RMS}"] * len(BANDS)) + "\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("folder", type=Path)
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--bands", default=",".join(BANDS))
+    parser.add_argument("--sources", type=int, default=3)
+    parser.add_argument("--images", action="store_true", help="also write the images and the rms csv")
+    parser.add_argument("--size", type=int, default=512, help="images size in pixels")
+    args = parser.parse_args()
+
+    positions = write_fit_files(args.folder / "fits", args.epochs, args.bands.split(","), args.sources)
+    if args.images:
+        write_images(args.folder / "images", positions, args.size)
+        write_rms_csv(args.folder / "rms.csv", args.epochs)
@@ -0,0 +1,68 @@
+import hashlib
+import logging
+import os
+import time
+
+from pathlib import Path
+from typing import BinaryIO, Callable, Optional
+
+from .utils import atomic_write
+
+logger = logging.getLogger()
+
+
+def file_key(path: Path) -> tuple:
+    """Identify a file by its path, size and mtime, without reading it"""
+    stat = path.stat()
+    return str(path.resolve()), stat.st_size, stat.st_mtime_ns
+
+
+class DiskCache:
+    """Folder of cached files, the least recently used ones are removed when it grows over max_size bytes"""
+
+    def __init__(self, folder: Path, max_size: int, suffix: str = ".npz"):
+        self.folder = folder
+        self.max_size = max_size
+        self.suffix = suffix
+
+    @staticmethod
+    def key(*parts) -> str:
+        return hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest()
+
+    def path(self, key: str) -> Path:
+        return self.folder / (key + self.suffix)
+
+    def get(self, key: str) -> Optional[Path]:
+        """Return the path of a cached entry, None if it is not cached"""
+        path = self.path(key)
+        try:
+            # the atime records the last use, the mtime is kept so cached files can be keyed by file_key too
+            os.utime(path, ns=(time.time_ns(), path.stat().st_mtime_ns))
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key: str, write: Callable[[BinaryIO], None]) -> Path:
+        """Store an entry by calling write on an open binary file"""
+        self.folder.mkdir(parents=True, exist_ok=True)
+        path = self.path(key)
+        with atomic_write(path, binary=True) as f: # workers may write the same entry concurrently
+            write(f)
+        self.evict()
+        return path
+
+    def evict(self):
+        entries = []
+        for path in self.folder.glob("*" + self.suffix):
+            try:
+                stat = path.stat()
+            except FileNotFoundError: # removed by another process
+                continue
+            entries.append((stat.st_atime_ns, stat.st_size, path))
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_size:
+                break
+            logger.debug(f"Removing {path} from cache")
+            path.unlink(missing_ok=True)
+            size -= entry_size
@@ -0,0 +1,237 @@
+import datetime
+import logging
+
+from decimal import Decimal
+from pathlib import Path
+from typing import Any, Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+
+from . import profiling
+from .utils import atomic_write
+
+logger = logging.getLogger()
+
+# one row per source, band level data (freq, major, minor) is repeated on each row of the (date, band) group
+# angles are stored in degrees, fluxes in mJy
+DTYPE = np.dtype([
+    ("date", "datetime64[D]"),
+    ("band", "U8"),
+    ("freq", "f8"),
+    ("major", "f8"),
+    ("minor", "f8"),
+    ("ra", "f8"),
+    ("ra_err", "f8"),
+    ("dec", "f8"),
+    ("dec_err", "f8"),
+    ("flux", "f8"),
+    ("flux_err", "f8"),
+    ("is_main", "i1"),
+])
+
+# unit of the flux and flux_err columns, fit files in other units are converted while parsing
+FLUX_UNIT = "mJy"
+
+# value of is_main when the main source has not been chosen yet ("" in the csv)
+UNKNOWN = -1
+
+# MJD of 1970-01-01, datetime64[D] values count the days since then
+MJD_UNIX_EPOCH = 40587
+
+SOURCE_FIELDS = ["ra", "ra_err", "dec", "dec_err", "flux", "flux_err", "is_main"]
+BAND_FIELDS = ["freq", "major", "minor"]
+
+
+def to_datetime(date: np.datetime64) -> datetime.datetime:
+    return datetime.datetime.combine(date.astype(datetime.date), datetime.time())
+
+
+def to_datetime64(date: datetime.date) -> np.datetime64:
+    return np.datetime64(date.strftime("%Y-%m-%d"), "D")
+
+
+class Catalog:
+    """Columnar source catalog, rows are grouped by (date, band) and kept in source order inside a group"""
+
+    def __init__(self, rows: Optional[np.ndarray] = None):
+        if rows is None:
+            rows = np.empty(0, dtype=DTYPE)
+        if not self.is_sorted(rows): # rows already grouped (e.g. a memory mapped catalog) are used without copy
+            rows = rows[np.lexsort((rows["band"], rows["date"]))] # lexsort is stable, sources keep their order
+        self.rows = rows
+        self._build_index()
+
+    @staticmethod
+    def is_sorted(rows: np.ndarray) -> bool:
+        date, band = rows["date"], rows["band"]
+        return bool(np.all((date[1:] > date[:-1]) | ((date[1:] == date[:-1]) & (band[1:] >= band[:-1]))))
+
+    def _build_index(self):
+        n = len(self.rows)
+        date, band = self.rows["date"], self.rows["band"]
+        change = np.ones(n, dtype=bool)
+        if n:
+            change[1:] = (date[1:] != date[:-1]) | (band[1:] != band[:-1])
+        self.starts = np.flatnonzero(change)
+        self.stops = np.append(self.starts[1:], n).astype(self.starts.dtype)
+        self._index = dict(zip(zip(date[self.starts].view(np.int64).tolist(), band[self.starts].tolist()), range(len(self.starts))))
+        # groups are sorted by date, so is the MJD of the groups of each band
+        self.mjd = (date[self.starts].view(np.int64) + MJD_UNIX_EPOCH).astype(float)
+        group_band = band[self.starts]
+        self._bands = {}
+        for b in np.unique(group_band).tolist():
+            groups = np.flatnonzero(group_band == b)
+            self._bands[b] = (groups, self.mjd[groups])
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @property
+    def ngroups(self) -> int:
+        return len(self.starts)
+
+    def query(self, band: Optional[str] = None, start: Optional[float] = None, stop: Optional[float] = None, mjds: Optional[np.ndarray] = None) -> "Selection":
+        """Select the groups of band whose MJD is between start and stop (included) and in mjds, without copying rows
+
+        The MJD range is found by bisection in the groups of the band, a query costs the groups it returns.
+        """
+        if band is None:
+            groups, mjd = np.arange(self.ngroups), self.mjd
+        else:
+            groups, mjd = self._bands.get(band, (np.empty(0, dtype=np.intp), np.empty(0)))
+        lo = 0 if start is None else np.searchsorted(mjd, start, "left")
+        hi = len(mjd) if stop is None else np.searchsorted(mjd, stop, "right")
+        groups, mjd = groups[lo:hi], mjd[lo:hi]
+        if mjds is not None:
+            groups = groups[np.isin(mjd, mjds)]
+        return Selection(self, groups)
+
+    def group(self, date: Any, band: str) -> Optional[np.ndarray]:
+        """Return a view on the sources of a (date, band), None if there is none"""
+        if not isinstance(date, np.datetime64):
+            date = to_datetime64(date)
+        i = self._index.get((int(date.astype(np.int64)), band))
+        if i is None:
+            return None
+        return self.rows[self.starts[i]:self.stops[i]]
+
+    def groups(self) -> Iterator[Tuple[datetime.datetime, str, np.ndarray]]:
+        """Yield (date, band, sources) for each group, sources being a view on the catalog rows"""
+        return iter(self.query())
+
+    @profiling.timed("npy_write")
+    def save(self, path: Path):
+        """Save the catalog as a .npy binary file, written to a temporary file first so it is never left half written"""
+        logger.info(f"Saving data to {path}")
+        with atomic_write(path, binary=True) as f:
+            np.save(f, np.ascontiguousarray(self.rows))
+            profiling.count("npy_write", sources=len(self.rows), bytes=f.tell())
+
+    @classmethod
+    def load(cls, path: Path, mmap: bool = True) -> "Catalog":
+        """Load a .npy catalog, memory mapped by default: rows are read from disk when used
+
+        The mapping is copy on write, changes (like getmain annotations) stay in memory until the
+        catalog is saved.
+        """
+        rows = np.load(path, mmap_mode="c" if mmap else None)
+        if rows.dtype != DTYPE:
+            raise ValueError(f"{path} is not a catalog of this version of pyfitsutils ({rows.dtype})")
+        return cls(rows)
+
+    @classmethod
+    def concatenate(cls, parts: Iterable[np.ndarray]) -> "Catalog":
+        """Build a catalog from several arrays of rows, e.g. one per fit file, grouped once at the end"""
+        parts = list(parts)
+        if not parts:
+            return cls()
+        return cls(np.concatenate(parts))
+
+    @classmethod
+    def from_records(cls, records: list[tuple]) -> "Catalog":
+        """Build a catalog from a list of tuples following DTYPE"""
+        return cls(np.array(records, dtype=DTYPE))
+
+    @classmethod
+    def from_dict(cls, fit_dict: dict[datetime.datetime, Any]) -> "Catalog":
+        """Build a catalog from the legacy {date: {band: {"data": ..., "sources": [...]}}} dict"""
+        records = []
+        for date, bands in fit_dict.items():
+            for band, data_sources in bands.items():
+                data = data_sources["data"]
+                for s in data_sources.get("sources", []):
+                    records.append((
+                        to_datetime64(date),
+                        band,
+                        float(data["freq"]),
+                        float(data["major"]),
+                        float(data["minor"]),
+                        s["ra"].deg,
+                        s["ra_err"].deg,
+                        s["dec"].deg,
+                        s["dec_err"].deg,
+                        float(s["flux"]),
+                        float(s["flux_err"]),
+                        UNKNOWN if s["is_main"] == "" else int(s["is_main"]),
+                    ))
+        return cls.from_records(records)
+
+    def to_dict(self) -> dict[datetime.datetime, Any]:
+        """Compatibility view, return the legacy dict made of Angle and Decimal objects"""
+        from astropy.coordinates import Angle
+        fit_dict = {}
+        for date, band, sources in self.groups():
+            fit_dict.setdefault(date, {})[band] = {
+                "data": {key: repr(float(sources[key][-1])) for key in BAND_FIELDS}, # the last block of a file sets the band data
+                "sources": [
+                    {
+                        "ra": Angle(s["ra"] / 15, "hourangle"),
+                        "ra_err": Angle(s["ra_err"] / 15, "hourangle"),
+                        "dec": Angle(s["dec"], "deg"),
+                        "dec_err": Angle(s["dec_err"], "deg"),
+                        "flux": Decimal(repr(float(s["flux"]))),
+                        "flux_err": Decimal(repr(float(s["flux_err"]))),
+                        "is_main": "" if s["is_main"] == UNKNOWN else int(s["is_main"]),
+                    } for s in sources
+                ]
+            }
+        return fit_dict
+
+
+class Selection:
+    """Groups of a catalog picked by Catalog.query, sources are views on the catalog rows"""
+
+    def __init__(self, fit_catalog: Catalog, groups: np.ndarray):
+        self.catalog = fit_catalog
+        self.groups = groups
+
+    def __len__(self) -> int:
+        return len(self.groups)
+
+    @property
+    def mjd(self) -> np.ndarray:
+        return self.catalog.mjd[self.groups]
+
+    def __iter__(self) -> Iterator[Tuple[datetime.datetime, str, np.ndarray]]:
+        """Yield (date, band, sources) for each selected group"""
+        rows, starts, stops = self.catalog.rows, self.catalog.starts, self.catalog.stops
+        for i in self.groups.tolist():
+            yield to_datetime(rows["date"][starts[i]]), str(rows["band"][starts[i]]), rows[starts[i]:stops[i]]
+
+    def epochs(self) -> Iterator[Tuple[float, np.ndarray]]:
+        """Yield (mjd, sources) for each selected group"""
+        rows, starts, stops = self.catalog.rows, self.catalog.starts, self.catalog.stops
+        for i, mjd in zip(self.groups.tolist(), self.mjd.tolist()):
+            yield mjd, rows[starts[i]:stops[i]]
+
+    def indices(self) -> np.ndarray:
+        """Return the indices in the catalog of the rows of the selected groups"""
+        starts, stops = self.catalog.starts[self.groups], self.catalog.stops[self.groups]
+        lengths = stops - starts
+        # concatenation of the ranges of each group without a python loop
+        return np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+    def main(self) -> np.ndarray:
+        """Return the indices in the catalog of the main sources (is_main == 1) of the selected groups"""
+        indices = self.indices()
+        return indices[self.catalog.rows["is_main"][indices] == 1]
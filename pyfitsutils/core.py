@@ -1,8 +1,10 @@
 import logging
+import sys
 
 from pathlib import Path
 
-from . import draw, fits
+from . import catalog, fits, profiling
+from .journal import Journal
 
 logger = logging.getLogger()
 logging.getLogger("matplotlib").setLevel("WARNING")
@@ -21,16 +23,21 @@ def cli():
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument("--fitsfolder", type=Path, action="append", help="folder containing fit files")
-    parser.add_argument("--csv", type=Path, action="append", help="csv file will be saved here", required=True)
+    parser.add_argument("--csv", type=Path, action="append", help="csv file will be saved here (binary catalog if it ends with .npy)", required=True)
     parser.add_argument("--imagesfolder", action="append", type=Path, help="folder containing fits images")
     parser.add_argument("--rmscsv", action="append", type=Path, help="csv file containing min/max rms values")
     parser.add_argument("--output", type=Path, help="output folder")
     parser.add_argument("--contours", action="store_true", help="draw contours")
     parser.add_argument("--save", action="store_true", help="save figures")
+    parser.add_argument("--preview", action="store_true", help="draw from downsampled images, faster for a quick look, ignored with --save where figures keep the full resolution [--draw, --getmain]")
     parser.add_argument("--drawband", type=str, help="draw only images for this specific band")
     parser.add_argument("--draw", action="store_true", help="WIP: draw figures")
+    parser.add_argument("--batch", action="store_true", help="render and save figures with a pool of headless workers [--draw]")
     parser.add_argument("--getmain", action="store_true", help="draw figures and ask for input to get main source")
     parser.add_argument("--forcegetmain", action="store_true", help="force getmain to ignore already checked sources [--getmain]")
+    parser.add_argument("--prefetch", type=int, help="draw the next N figures in background workers while the main source is chosen [--getmain]")
+    parser.add_argument("--automain", action="store_true", help="set is_main where the source tracked across epochs near the target is unambiguous, getmain only asks for the other epochs")
+    parser.add_argument("--compactevery", type=int, help="save the csv every N getmain decisions instead of only at the end [--getmain]")
     parser.add_argument("--drawangsep", type=str, help="draw angsep for specified band")
     parser.add_argument("--drawrasep", type=str, help="draw ra separation for specified band")
     parser.add_argument("--drawangsepbrightest", type=str, help="draw angsep vs brightest for specified band")
@@ -40,56 +47,123 @@ def cli():
     parser.add_argument("--reference", action="store_true", help="draw rasep using reference source as main [--drawrasep]")
     parser.add_argument("--maxdate", type=int, help="do not draw anything more recent than maxdate")
     parser.add_argument("--listdate", type=Path, help="draw only dates from the list")
+    parser.add_argument("--workers", type=int, help="number of processes used to parse fit files, also sizes the pools of --batch and --prefetch (default: number of cpus)")
+    parser.add_argument("--nocache", action="store_true", help="parse every fit file and rewrite the csv even if no fit file changed")
+    parser.add_argument("--watch", action="store_true", help="keep running, ingest new fit files and draw again the figures they or new images affect")
+    parser.add_argument("--interval", type=float, default=2.0, help="seconds between two scans of the folders [--watch]")
+    parser.add_argument("--profile", type=Path, help="time the stages of the run, log a summary at the end and save it as json here")
+    parser.add_argument("--profilestage", type=str, help="also run this stage under cProfile (parse, merge, crossmatch, csv_read, csv_write, npy_write, draw, fits_load, contours, savefig, series, batch_render) [--profile]")
     args = parser.parse_args()
+    preview = args.preview and not args.save
+
+    if args.profile:
+        profiling.enable(args.profilestage)
 
     assert len(args.imagesfolder) == len(args.csv), "there should be the same amount of images folders and csv files"
 
-    fit_dicts = list(fits.Fit.folders_and_csv2dict(args.csv, args.fitsfolder))
+    # datasets load concurrently, the per image loops below start on the first one while the others load
+    loading = fits.Fit.folders_and_csv2catalog(args.csv, args.fitsfolder, args.workers, not args.nocache)
+    fit_catalogs = []
+
+    # getmain decisions go to a journal, replaying it resumes an interrupted session
+    journals = [Journal.for_catalog(csv) for csv in args.csv]
+    decided = []
+
+    def datasets():
+        """Yield (i, catalog) of every dataset, waiting for the ones still loading"""
+        for i in range(len(args.csv)):
+            if i == len(fit_catalogs):
+                fit_catalogs.append(next(loading))
+                decided.append(journals[i].replay(fit_catalogs[i]))
+                if args.automain:
+                    from . import crossmatch # imports astropy through settings
+                    if crossmatch.propose_main(fit_catalogs[i]):
+                        compact(i)
+            yield i, fit_catalogs[i]
+
+    def compact(i):
+        fits.Fit.save_catalog(fit_catalogs[i], args.csv[i])
+        journals[i].clear()
 
     if args.draw or args.getmain or args.drawangsep or args.drawangsepbrightest or args.drawrasep or args.drawflux:
+        from . import draw # matplotlib, aplpy and astropy are only imported when something is drawn
         draw.init(args.rmscsv)
 
-    if args.draw:
-        for i, f_dict in enumerate(fit_dicts):
-            for date, bands in f_dict.items():
-                for band, datasources in bands.items():
-                    if args.drawband and not band == args.drawband:
-                        continue
-                    draw.draw_sources(
+    failures = [] # images --batch could not render, each is logged
+    if args.draw and args.batch:
+        failures = draw.draw_sources_batch(
+            [f_catalog for _, f_catalog in datasets()],
+            args.imagesfolder,
+            args.rmscsv,
+            args.output,
+            contours=args.contours,
+            drawband=args.drawband,
+            workers=args.workers
+        )
+
+    elif args.draw:
+        import matplotlib.pyplot as plt
+        for i, f_catalog in datasets():
+            draw.check_images(args.imagesfolder[i], f_catalog.query(args.drawband or None))
+            for date, band, sources in f_catalog.query(args.drawband or None):
+                fig = draw.draw_sources(
+                    date=date, 
+                    band=band, 
+                    sources=sources, 
+                    imagesfolder=args.imagesfolder[i], 
+                    output=args.output, 
+                    contours=args.contours, 
+                    save=args.save,
+                    data_index=i,
+                    preview=preview
+                )
+                if fig and args.save:
+                    plt.close(fig) # nothing is shown, do not keep every figure in memory
+
+    elif args.getmain or args.drawangsep or args.drawangsepbrightest or args.drawrasep or args.drawflux:
+        for i, f_catalog in datasets():
+            to_annotate = [
+                (date, band, sources) for date, band, sources in f_catalog.groups()
+                if (catalog.to_datetime64(date), band) not in decided[i] # already annotated by the interrupted session
+                and not (args.leftmost or args.rightmost) and ((sources["is_main"] == catalog.UNKNOWN).any() or args.forcegetmain)
+            ]
+            if to_annotate: # only the figures getmain draws need their image
+                draw.check_images(args.imagesfolder[i], to_annotate)
+            # getmain writes is_main directly in the catalog rows
+            if args.prefetch:
+                annotated = draw.getmain_prefetched(to_annotate, args.imagesfolder[i], args.output, args.contours, args.save, i, args.rmscsv, args.prefetch, args.workers, preview)
+            else:
+                annotated = (
+                    (date, band, draw.getmain(
                         date=date, 
                         band=band, 
-                        sources=datasources["sources"], 
+                        sources=sources, 
                         imagesfolder=args.imagesfolder[i], 
                         output=args.output, 
-                        contours=args.contours, 
+                        contours=args.contours,
                         save=args.save,
-                        data_index=i
-                    )
-
-    elif args.getmain or args.drawangsep or args.drawangsepbrightest or args.drawrasep or args.drawflux:
-        for i, f_dict in enumerate(fit_dicts):
-            for date, bands in f_dict.items():
-                for band, datasources in bands.items():
-                    if not (args.leftmost or args.rightmost) and (any([s["is_main"] == "" for s in datasources["sources"]]) or args.forcegetmain):
-                        sources = draw.getmain(
-                            date=date, 
-                            band=band, 
-                            sources=datasources["sources"], 
-                            imagesfolder=args.imagesfolder[i], 
-                            output=args.output, 
-                            contours=args.contours,
-                            save=args.save,
-                            data_index=i
-                        )
-                    sources = datasources["sources"]
-                    if sources is None:
-                        continue
-                    f_dict[date][band]["sources"] = sources
-                    fits.Fit.dict2csv(f_dict, args.csv[i])
+                        data_index=i,
+                        preview=preview
+                    ))
+                    for date, band, sources in to_annotate
+                )
+            for date, band, sources in annotated:
+                if sources is None:
+                    continue
+                journals[i].record(date, band, sources)
+                if args.compactevery and journals[i].pending >= args.compactevery:
+                    compact(i)
+
+    for _ in datasets():
+        pass # the time series and the watch mode use every dataset
+
+    for i, journal in enumerate(journals):
+        if journal.pending:
+            compact(i)
     
     if args.drawangsep:
         draw.draw_angsep(
-            fit_dicts,
+            fit_catalogs,
             args.drawangsep,
             args.output,
             args.leftmost,
@@ -100,7 +174,7 @@ def cli():
 
     if args.drawrasep:
         draw.draw_rasep(
-            fit_dicts,
+            fit_catalogs,
             args.drawrasep,
             args.output,
             args.leftmost,
@@ -112,7 +186,7 @@ def cli():
 
     if args.drawangsepbrightest:
         draw.draw_angsep_brightest(
-            fit_dicts,
+            fit_catalogs,
             args.drawangsepbrightest,
             args.output,
             args.leftmost,
@@ -123,7 +197,7 @@ def cli():
 
     if args.drawflux:
         draw.draw_flux(
-            fit_dicts,
+            fit_catalogs,
             args.drawflux,
             args.output,
             args.leftmost,
@@ -132,5 +206,45 @@ def cli():
             args.listdate
         )
 
+    if args.watch:
+        from .watch import Watcher
+        series = [
+            (metric, band, draw.strategy(args.leftmost, args.rightmost, args.reference and metric == "rasep"))
+            for metric, band in [("angsep", args.drawangsep), ("rasep", args.drawrasep), ("angsep_brightest", args.drawangsepbrightest), ("flux", args.drawflux)]
+            if band
+        ]
+        Watcher(
+            args.csv,
+            args.fitsfolder,
+            args.imagesfolder,
+            args.rmscsv,
+            args.output,
+            fit_catalogs,
+            contours=args.contours,
+            drawband=args.drawband,
+            draw_epochs=args.draw,
+            series=series,
+            maxdate=args.maxdate,
+            listdate=args.listdate,
+            workers=args.workers,
+            interval=args.interval,
+        ).run()
+
+    if args.profile:
+        logger.info(profiling.summary())
+        profiling.save(args.profile)
+
+    if failures:
+        logger.error(f"{len(failures)} images could not be rendered")
+        sys.exit(1)
+
+def convert():
+    import argparse
+    parser = argparse.ArgumentParser(description="convert a catalog between csv and binary (.npy) formats")
+    parser.add_argument("src", type=Path, help="catalog to read")
+    parser.add_argument("dst", type=Path, help="catalog to write, binary if it ends with .npy, csv otherwise")
+    args = parser.parse_args()
+    fits.Fit.convert(args.src, args.dst)
+
 if __name__ == "__main__":
     cli()
\ No newline at end of file
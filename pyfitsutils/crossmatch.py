@@ -0,0 +1,244 @@
+import logging
+
+from typing import Iterator, Optional
+
+import numpy as np
+
+from . import catalog, profiling, settings
+from .catalog import Catalog
+
+logger = logging.getLogger()
+
+# detections of the same source are within this many combined position errors...
+MATCH_SIGMAS = 3.0
+# ...plus this fraction of the beam major axis, a blended component is not positioned better than that
+BEAM_FRACTION = 0.25
+# the main source track must be seen at this many dates at least
+MIN_EPOCHS = 3
+# rounds moving the track seeds to the center of their detections
+REFINE = 2
+# the 3x3 block of cells around a cell
+NEIGHBOUR_CELLS = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+
+
+def offsets(rows: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Gnomonic projection of the sources on the sky plane around settings.TARGET, (x, y) in arcsec"""
+    ra0, dec0 = settings.TARGET["ra"].rad, settings.TARGET["dec"].rad
+    ra, dec = np.radians(rows["ra"]), np.radians(rows["dec"])
+    cos_dra = np.cos(ra - ra0)
+    cos_c = np.sin(dec0) * np.sin(dec) + np.cos(dec0) * np.cos(dec) * cos_dra
+    x = np.cos(dec) * np.sin(ra - ra0) / cos_c
+    y = (np.cos(dec0) * np.sin(dec) - np.sin(dec0) * np.cos(dec) * cos_dra) / cos_c
+    return np.degrees(x) * 3600, np.degrees(y) * 3600
+
+def tolerances(rows: np.ndarray) -> np.ndarray:
+    """Matching radius of each detection in arcsec, from its position errors and the beam of its image"""
+    sigma = np.hypot(rows["ra_err"] * np.cos(np.radians(rows["dec"])), rows["dec_err"]) * 3600
+    return MATCH_SIGMAS * sigma + BEAM_FRACTION * rows["major"]
+
+
+class Grid:
+    """Points indexed on square cells of cell_size arcsec, the points of an occupied cell are a slice of order"""
+
+    def __init__(self, x: np.ndarray, y: np.ndarray, cell_size: float):
+        self.cell_size = cell_size
+        # a margin of two cells so the keys of the neighbours of neighbours never wrap to the next column
+        self.origin = (x.min() - 2 * cell_size, y.min() - 2 * cell_size)
+        self.width = int((y.max() - self.origin[1]) // cell_size) + 5
+        keys = self.key(x, y)
+        self.order = np.argsort(keys, kind="stable")
+        keys = keys[self.order]
+        first = np.flatnonzero(np.append(True, keys[1:] != keys[:-1]))
+        self.cells = keys[first] # occupied cells, sorted
+        self.starts = np.append(first, len(keys))
+        self.cell_of = np.empty(len(keys), np.int64)
+        self.cell_of[self.order] = np.repeat(np.arange(len(first)), np.diff(self.starts))
+
+    def key(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        cx = np.floor((x - self.origin[0]) / self.cell_size).astype(np.int64)
+        cy = np.floor((y - self.origin[1]) / self.cell_size).astype(np.int64)
+        return cx * self.width + cy
+
+    def neighbours(self, keys: np.ndarray, cells: Optional[np.ndarray] = None) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+        """For each of the 9 cells around keys, yield (found, index) of the ones in cells (sorted, the occupied cells by default)"""
+        cells = self.cells if cells is None else cells
+        for dx, dy in NEIGHBOUR_CELLS:
+            shifted = keys + dx * self.width + dy
+            index = np.minimum(np.searchsorted(cells, shifted), len(cells) - 1)
+            found = cells[index] == shifted
+            yield found, index[found]
+
+    def pairs(self, x: np.ndarray, y: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """(point, indexed point) pairs of the points at (x, y) and the indexed points of the 3x3 block of their cell"""
+        pairs_a, pairs_b = [], []
+        for found, index in self.neighbours(self.key(x, y)):
+            counts = self.starts[index + 1] - self.starts[index]
+            first = np.repeat(self.starts[index] - np.cumsum(counts) + counts, counts)
+            pairs_a.append(np.repeat(np.flatnonzero(found), counts))
+            pairs_b.append(self.order[first + np.arange(counts.sum())])
+        return np.concatenate(pairs_a), np.concatenate(pairs_b)
+
+def assign(x: np.ndarray, y: np.ndarray, tolerance: np.ndarray, grid: Grid, seed_x: np.ndarray, seed_y: np.ndarray) -> np.ndarray:
+    """Closest seed of each detection within its tolerance, -1 if none
+
+    grid indexes the detections on cells of their largest tolerance, so the seeds a detection can join
+    are in the 3x3 block of its cell. The detections of a cell are compared to these seeds at once.
+    """
+    best = np.full(len(x), -1)
+    seeds = [[] for _ in grid.cells]
+    for found, cell in grid.neighbours(grid.key(seed_x, seed_y)):
+        for seed, c in zip(np.flatnonzero(found), cell):
+            seeds[c].append(seed)
+    for cell, candidates in enumerate(seeds):
+        if not candidates:
+            continue
+        candidates = np.array(candidates)
+        members = grid.order[grid.starts[cell]:grid.starts[cell + 1]]
+        distance = np.hypot(x[members, None] - seed_x[candidates], y[members, None] - seed_y[candidates])
+        closest = np.argmin(distance, axis=1)
+        within = distance[np.arange(len(members)), closest] <= tolerance[members]
+        best[members[within]] = candidates[closest[within]]
+    return best
+
+def components(pairs_a: np.ndarray, pairs_b: np.ndarray, n: int) -> np.ndarray:
+    """Connected components of a graph of n nodes given by its edges, labelled 0, 1... in the order of their smallest node"""
+    labels = np.arange(n)
+    while True:
+        new = labels.copy()
+        np.minimum.at(new, pairs_a, labels[pairs_b])
+        np.minimum.at(new, pairs_b, labels[pairs_a])
+        new = new[new] # jump to the label of the label, chains collapse in a few iterations
+        if np.array_equal(new, labels):
+            return np.unique(labels, return_inverse=True)[1]
+        labels = new
+
+def centers(track: np.ndarray, x: np.ndarray, y: np.ndarray, weight: np.ndarray, seed_x: np.ndarray, seed_y: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Weighted (x, y) center of the detections of each track and their typical tolerance, a track
+    without detections stays at its seed with a tolerance of 0"""
+    linked = track >= 0
+    n = len(seed_x)
+    total = np.bincount(track[linked], weight[linked], n)
+    moved = total > 0
+    center_x, center_y, typical = seed_x.copy(), seed_y.copy(), np.zeros(n)
+    center_x[moved] = np.bincount(track[linked], (weight * x)[linked], n)[moved] / total[moved]
+    center_y[moved] = np.bincount(track[linked], (weight * y)[linked], n)[moved] / total[moved]
+    typical[moved] = np.sqrt(np.bincount(track[linked], minlength=n)[moved] / total[moved])
+    return center_x, center_y, typical
+
+def merge(seed_x: np.ndarray, seed_y: np.ndarray, typical: np.ndarray) -> np.ndarray:
+    """Group the seeds closer than the typical tolerance of one of them, return the group of each seed"""
+    if not typical.any():
+        return np.arange(len(seed_x))
+    seeds = Grid(seed_x, seed_y, typical.max())
+    pairs_a, pairs_b = seeds.pairs(seed_x, seed_y)
+    close = np.hypot(seed_x[pairs_a] - seed_x[pairs_b], seed_y[pairs_a] - seed_y[pairs_b]) <= np.maximum(typical[pairs_a], typical[pairs_b])
+    return components(pairs_a[close], pairs_b[close], len(seed_x))
+
+def tracks(x: np.ndarray, y: np.ndarray, tolerance: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Link detections at offsets (x, y) into tracks, return the track of each one (-1 for none) and the
+    (x, y) centers of the tracks
+
+    Detections are counted on a grid of cells of their median tolerance. A source seen at many epochs
+    piles its detections up in a few cells, so the cells (occupied or not) holding the most detections
+    of their 3x3 block seed the tracks (linking neighbours to neighbours would chain the unrelated
+    sources of a crowded field into one). Each detection joins the closest seed within its tolerance,
+    then for REFINE rounds the seeds move to the weighted center of their detections and the seeds
+    within tolerance of each other, the halves of a source split by a cell edge, are merged.
+    """
+    labels = np.full(len(x), -1)
+    valid = np.flatnonzero(np.isfinite(x) & np.isfinite(y) & (tolerance > 0))
+    if not len(valid):
+        return labels, np.empty(0), np.empty(0)
+    x, y, tolerance = x[valid], y[valid], tolerance[valid]
+    weight = 1.0 / tolerance**2
+
+    grid = Grid(x, y, np.median(tolerance))
+    count = np.bincount(grid.cell_of)
+    cell_x, cell_y, cell_weight = np.bincount(grid.cell_of, weight * x), np.bincount(grid.cell_of, weight * y), np.bincount(grid.cell_of, weight)
+    # an empty cell between two occupied ones can be the center of a source
+    cells = np.unique(np.concatenate([grid.cells + dx * grid.width + dy for dx, dy in NEIGHBOUR_CELLS]))
+    block, block_x, block_y, block_weight = (np.zeros(len(cells)) for _ in range(4))
+    for found, index in grid.neighbours(cells):
+        block[found] += count[index]
+        block_x[found] += cell_x[index]
+        block_y[found] += cell_y[index]
+        block_weight[found] += cell_weight[index]
+    # strict local maxima of the block counts, ties broken by the cell order
+    score = block * len(cells) + np.arange(len(cells))[::-1]
+    is_peak = block >= MIN_EPOCHS
+    for found, index in grid.neighbours(cells, cells):
+        is_peak[found] &= score[found] >= score[index]
+    peaks = np.flatnonzero(is_peak)
+    if not len(peaks):
+        return labels, np.empty(0), np.empty(0)
+
+    seed_x, seed_y = block_x[peaks] / block_weight[peaks], block_y[peaks] / block_weight[peaks]
+    detections = Grid(x, y, tolerance.max())
+    track = assign(x, y, tolerance, detections, seed_x, seed_y)
+    for _ in range(REFINE):
+        seed_x, seed_y, typical = centers(track, x, y, weight, seed_x, seed_y)
+        group = merge(seed_x, seed_y, typical)
+        if group.max() < len(group) - 1: # some seeds were merged
+            first = np.unique(group, return_index=True)[1]
+            track = np.where(track >= 0, group[track], -1)
+            seed_x, seed_y, _ = centers(track, x, y, weight, seed_x[first], seed_y[first])
+        track = assign(x, y, tolerance, detections, seed_x, seed_y)
+    labels[valid] = track
+    return labels, seed_x, seed_y
+
+def main_track(labels: np.ndarray, center_x: np.ndarray, center_y: np.ndarray, tolerance: np.ndarray, date: np.ndarray) -> int:
+    """Track of the main source: seen at MIN_EPOCHS dates at least, within its tolerance of the target,
+    the one seen at the most dates. -1 if no track qualifies."""
+    linked = labels >= 0
+    if not linked.any():
+        return -1
+    track = labels[linked]
+    n_tracks = len(center_x)
+    distance = np.hypot(center_x, center_y)
+    # a track matches the target within the typical tolerance of its detections and the target error
+    with np.errstate(divide="ignore", invalid="ignore"):
+        typical = np.sqrt(np.bincount(track, minlength=n_tracks) / np.bincount(track, tolerance[linked]**-2, n_tracks))
+    target_error = np.hypot(settings.TARGET["ra_err"].deg * np.cos(settings.TARGET["dec"].rad), settings.TARGET["dec_err"].deg) * 3600
+    date = date[linked].view(np.int64)
+    date = date - date.min()
+    seen = np.unique(track * (date.max() + 1) + date) # one per (track, date)
+    dates = np.bincount(seen // (date.max() + 1), minlength=n_tracks)
+
+    candidates = np.flatnonzero((dates >= MIN_EPOCHS) & (distance <= typical + MATCH_SIGMAS * target_error))
+    if not len(candidates):
+        return -1
+    return int(candidates[np.lexsort((distance[candidates], -dates[candidates]))[0]])
+
+@profiling.timed("crossmatch")
+def propose_main(fit_catalog: Catalog, overwrite: bool = False) -> int:
+    """Set is_main in the groups where exactly one source belongs to the main source track
+
+    Only groups with an unknown is_main are changed unless overwrite. Groups where the main track
+    has no source or several are left for getmain. Return the number of groups decided.
+    """
+    rows = fit_catalog.rows
+    if not len(rows):
+        return 0
+    x, y = offsets(rows)
+    tolerance = tolerances(rows)
+    labels, center_x, center_y = tracks(x, y, tolerance)
+    main = main_track(labels, center_x, center_y, tolerance, rows["date"])
+    if main < 0:
+        logger.warning("No track of sources matches the target, is_main is left to getmain")
+        return 0
+
+    starts, lengths = fit_catalog.starts, fit_catalog.stops - fit_catalog.starts
+    members = labels == main
+    in_main = np.add.reduceat(members.astype(np.int64), starts)
+    undecided = np.add.reduceat((rows["is_main"] == catalog.UNKNOWN).astype(np.int64), starts) > 0
+    decided = (in_main == 1) & (undecided | overwrite)
+    rows_decided = np.repeat(decided, lengths)
+    rows["is_main"][rows_decided] = members[rows_decided]
+
+    logger.info(
+        f"Main source track seen in {np.count_nonzero(in_main)} of {fit_catalog.ngroups} epochs: "
+        f"is_main proposed for {np.count_nonzero(decided)}, "
+        f"{np.count_nonzero(undecided & (in_main > 1))} ambiguous and {np.count_nonzero(undecided & (in_main == 0))} without it left for getmain"
+    )
+    profiling.count("crossmatch", sources=len(rows), proposed=int(np.count_nonzero(decided)))
+    return int(np.count_nonzero(decided))
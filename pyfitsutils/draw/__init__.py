@@ -1,18 +1,22 @@
+import collections
 import csv
 import datetime
+import io
+import itertools
 import logging
+import multiprocessing
+import os
 
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
-from typing import Optional
+from typing import Iterable, Iterator, Optional
 
-import aplpy
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib as mpl
 
-from astropy.time import Time
-
-from pyfitsutils import utils, settings
+from pyfitsutils import profiling, utils, settings
+from pyfitsutils.catalog import FLUX_UNIT, Catalog
 
 logger = logging.getLogger(__name__)
 
@@ -32,33 +36,91 @@ def init(rms_csvs: list[Path]):
                 settings.LIST_DICT_SHEET[i][line[1]] = {"Lband":[line[4],line[5],line[6]], "Cband":[line[7],line[8],line[9]], "Xband":[line[10],line[11],line[12]], "Kuband":[line[13],line[14],line[15]], "Kband":[line[16],line[17],line[18]]}
 
 
+# (date, band) -> images of each images folder, scanned again only when the folder mtime changes
+_image_indexes: dict[Path, tuple[int, dict]] = {}
+
+def index_images(images_folder: Path) -> dict[tuple[str, str], list[Path]]:
+    """Return the images of images_folder by (date, band), the date being formatted like in their name
+
+    A missing folder (e.g. not mounted) has no images, every image is then logged as missing.
+    """
+    try:
+        mtime = images_folder.stat().st_mtime_ns
+    except FileNotFoundError:
+        logger.warning(f"Images folder {images_folder} not found")
+        return {}
+    cached = _image_indexes.get(images_folder)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    logger.info(f"Indexing images of {images_folder}")
+    index = {}
+    with os.scandir(images_folder) as entries:
+        for entry in entries:
+            epoch = utils.image_epoch(entry.name)
+            if epoch:
+                index.setdefault(epoch, []).append(Path(entry.path))
+    for (date, band), images in index.items():
+        images.sort()
+        if len(images) > 1:
+            logger.warning(f"{len(images)} images for {date} ({band}band) in {images_folder}: {', '.join(image.name for image in images)}")
+    _image_indexes[images_folder] = (mtime, index)
+    return index
+
+def check_images(images_folder: Path, groups: Iterable[tuple]) -> list[tuple[datetime.datetime, str]]:
+    """Log and return the (date, band) of the (date, band, sources) groups without a single image in images_folder"""
+    index = index_images(images_folder)
+    missing = [
+        (date, band) for date, band, *_ in groups
+        if len(index.get((date.strftime('%d%b%Y').lower(), band), [])) != 1
+    ]
+    if missing:
+        logger.warning(f"{len(missing)} images missing or duplicated in {images_folder}: {', '.join(f'{date:%Y-%m-%d} {band}' for date, band in missing)}")
+    return missing
+
 def load_fits(images_folder: Path, date: datetime.datetime, band: str) -> Optional[Path]:
-    image_glob = f"{date.strftime('%d%b%Y').lower()}_{band}band_*"
-    fits_images = list(images_folder.glob(image_glob))
+    fits_images = index_images(images_folder).get((date.strftime('%d%b%Y').lower(), band), [])
     if len(fits_images) == 1:
         return fits_images[0]
     else:
-        logger.warning(f"Image matching {image_glob} not found in {images_folder}")
+        logger.warning(f"Image matching {date.strftime('%d%b%Y').lower()}_{band}band_* not found in {images_folder}")
         return None
 
 def draw_target(fig, target, label="", cross=True):
     logger.info(f"Adding target {label} at coordinates {target}")
+    ra, ra_err = utils.to_deg(target["ra"]), utils.to_deg(target["ra_err"])
+    dec, dec_err = utils.to_deg(target["dec"]), utils.to_deg(target["dec_err"])
     line_liste = [
         np.array([
-            [target["ra"].deg - target["ra_err"].deg, target["ra"].deg + target["ra_err"].deg],
-            [target["dec"].deg, target["dec"].deg]
+            [ra - ra_err, ra + ra_err],
+            [dec, dec]
         ]),
         np.array([
-            [target["ra"].deg, target["ra"].deg],
-            [target["dec"].deg - target["dec_err"].deg, target["dec"].deg + target["dec_err"].deg]
+            [ra, ra],
+            [dec - dec_err, dec + dec_err]
         ])
     ]
     if cross:
         fig.show_lines(line_liste,color='dodgerblue',linewidth=1.5)
     if label:
-        fig.add_label(target["ra"].deg, target["dec"].deg, label, color='dodgerblue', size=settings.LABEL_SIZE)
+        fig.add_label(ra, dec, label, color='dodgerblue', size=settings.LABEL_SIZE)
+
+def main_index(sources: np.ndarray, leftmost=False, rightmost=False) -> int:
+    """Return the index of the main source of a (date, band) group"""
+    if leftmost:
+        return int(np.argmax(sources["ra"]))
+    elif rightmost:
+        return int(np.argmin(sources["ra"]))
+    return int(np.flatnonzero(sources["is_main"] == 1)[0])
+
+@profiling.timed("draw")
+def draw_sources(date: datetime.date, band: str, sources: np.ndarray, imagesfolder:Path, output: Path, contours: bool, save: bool, data_index: int, preview=False):
+    # aplpy and the image modules are slow to import and only needed here, not for the time series
+    import aplpy
+    from pyfitsutils.draw.contours import contour_lines
+    from pyfitsutils.draw.cutouts import cutout
+    from pyfitsutils.draw.previews import preview_image
 
-def draw_sources(date: datetime.date, band: str, sources: list, imagesfolder:Path, output: Path, contours: bool, save: bool, data_index: int):
     settings_dict = settings.LIST_DICT_SHEET[data_index]
     img = load_fits(imagesfolder, date, band)
     if not img:
@@ -75,17 +137,24 @@ def draw_sources(date: datetime.date, band: str, sources: list, imagesfolder:Pat
 
     logger.info(f"Processing {img}")
 
-    fig1 = aplpy.FITSFigure(img.as_posix(), figure=fig, auto_refresh=False) # not sure if auto_refresh is usefull
+    # only the window around the target is read and colour scaled, see draw.cutouts
+    with profiling.span("fits_load"):
+        if preview: # drawn from a downsampled level of the image, see draw.previews
+            img = preview_image(img, radius)
+        cut = cutout(img, settings.TARGET["ra"].deg, settings.TARGET["dec"].deg, radius)
+        fig1 = aplpy.FITSFigure(cut.as_posix(), figure=fig, auto_refresh=False) # not sure if auto_refresh is usefull
     logger.info("Centering image")
     fig1.recenter(settings.TARGET["ra"].deg, settings.TARGET["dec"].deg, radius) # center and zoom on the target location
 
     fig1.set_theme('publication')
     fig1.show_colorscale(cmap='hot',vmin=min_val,vmax=max_val) # set the colorscale of the figure
 
-    # add contour /!\ VERY SLOW !!!
+    # add contour, computed once per image and levels (see draw.contours)
     if contours:
         logger.info("Adding contours")
-        fig1.show_contour(img.as_posix(), levels=levels, colors='lime', layer='contours', linewidths = 1)
+        with profiling.span("contours"):
+            lines = contour_lines(img, levels, settings.TARGET["ra"].deg, settings.TARGET["dec"].deg, radius)
+        fig1.show_lines(lines, color='lime', linewidth=1, layer='contours')
 
     draw_target(fig1, settings.TARGET) # show target as a blue cross with error bars on the figure
 
@@ -132,190 +201,186 @@ def draw_sources(date: datetime.date, band: str, sources: list, imagesfolder:Pat
 
     if save:
         logger.info("Saving figures")
-        fig.savefig(output / (f"XTEJ1748-288_{data_index}_{date.strftime('%Y-%m-%d')}_{band}_rob0.png"), format='png', dpi=300, bbox_inches='tight')
-        fig.savefig(output / (f"XTEJ1748-288_{data_index}_{date.strftime('%Y-%m-%d')}_{band}_rob0.pdf"), bbox_inches='tight', pad_inches = 0.05)
-    
+        name = f"XTEJ1748-288_{data_index}_{date.strftime('%Y-%m-%d')}_{band}_rob0"
+        with profiling.span("savefig", figures=2):
+            fig.savefig(output / f"{name}.png", format='png', dpi=300, bbox_inches='tight')
+            fig.savefig(output / f"{name}.pdf", bbox_inches='tight', pad_inches = 0.05)
+        if profiling.enabled:
+            profiling.count("savefig", bytes=sum((output / f"{name}.{ext}").stat().st_size for ext in ("png", "pdf")))
+
+    profiling.count("draw", figures=1)
     return fig
 
-def draw_angsep(fit_dicts: dict, band_chosen: str, output: Path, leftmost=False, rightmost=False, maxdate=None, listdate=None):
-    if listdate is not None: # on ouvre le fichier qu'une seule fois au lieu d'à chaque item
-        with open(listdate) as f :
-            list_dates = f.readlines() 
-    for i, fit_dict in enumerate(fit_dicts):
-        for date, bands in fit_dict.items():
-            if maxdate and Time(date).mjd > maxdate :
-                continue
-            if listdate and Time(date).mjd not in list_dates: # et là faut convertir la date en mjd
-                continue
-            for band, sourcesdata in bands.items():
-                plt.figure(1)
-                if band != band_chosen:
-                    continue
-                if leftmost:
-                    sourcesdata["sources"].sort(key=lambda x: x["ra"], reverse=True)
-                    main_source = sourcesdata["sources"][0]
-                elif rightmost:
-                    sourcesdata["sources"].sort(key=lambda x: x["ra"])
-                    main_source = sourcesdata["sources"][0]
-                else:
-                    main_source = list(filter(lambda x: int(x["is_main"]) == 1, sourcesdata["sources"]))[0]
-                beam_err = 0.1*np.sqrt(float(sourcesdata["data"]["minor"])*float(sourcesdata["data"]["major"]))
-                for source in sourcesdata["sources"]:
-                    if source == main_source:
-                        continue
-                    sep = utils.angsep(
-                        main_source["ra"], main_source["ra_err"], main_source["dec"], main_source["dec_err"],
-                        source["ra"], source["ra_err"], source["dec"], source["dec_err"],
-                    )
-                    if source["ra"].arcsec > main_source["ra"].arcsec:
-                        plt.errorbar(Time(date).mjd, -sep[0].arcsec, yerr=sep[1].arcsec,marker="o",color=settings.COLORS[i%len(settings.COLORS)], ecolor='black', linestyle='', capsize=1, elinewidth=0.5, markeredgewidth=0.3, markersize=3, markeredgecolor='black')
-                    else:
-                        plt.errorbar(Time(date).mjd, sep[0].arcsec, yerr=sep[1].arcsec,marker="o",color=settings.COLORS[i%len(settings.COLORS)], ecolor='black', linestyle='', capsize=1, elinewidth=0.5, markeredgewidth=0.3, markersize=3, markeredgecolor='black')
-
-
-    plt.ylabel("Angular separation (as)")
-    plt.xlabel("Date")
-    plt.minorticks_on()
-    plt.tick_params(axis='both',which='both',direction = 'in', top=True, right=True)#, labelsize = 12)
-    plt.xticks(rotation=90)
-    plt.gca().xaxis.set_major_formatter(mpl.ticker.FuncFormatter(lambda x,_: f"({Time(x,format='mjd').to_value('iso', subfmt='date')}) {x}"))
-    plt.savefig(output / f"angsep_{band_chosen}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}{'left' if leftmost else 'right' if rightmost else ''}.jpg",bbox_inches='tight',dpi=300)
-    plt.savefig(output / f"angsep_{band_chosen}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}{'left' if leftmost else 'right' if rightmost else ''}.pdf",bbox_inches='tight')
-    plt.show()
+def _init_render_worker(rms_csvs: list[Path]):
+    mpl.use("Agg", force=True) # workers never display anything
+    init(rms_csvs)
+
+def _render_sources(date: datetime.date, band: str, sources: np.ndarray, imagesfolder: Path, output: Path, contours: bool, data_index: int) -> Optional[str]:
+    """Render and save one image in a worker, return an error message if it failed"""
+    try:
+        fig = draw_sources(date, band, sources, imagesfolder, output, contours, True, data_index)
+    except Exception as e:
+        plt.close("all")
+        return f"{type(e).__name__}: {e}"
+    if fig is None:
+        return "image not found"
+    plt.close(fig) # keep the memory of the worker bounded
+    return None
 
-def draw_rasep(fit_dicts: dict, band_chosen: str, output: Path, leftmost=False, rightmost=False, reference=False, maxdate=None, listdate=None):
+@profiling.timed("batch_render")
+def draw_sources_batch(fit_catalogs: list[Catalog], imagesfolders: list[Path], rms_csvs: list[Path], output: Path, contours=False, drawband=None, workers=None) -> list[tuple[str, str]]:
+    """Render and save the image of every (dataset, date, band) with a pool of headless worker processes
+
+    Each task draws a single figure with the Agg backend, saves it and closes it. Progress and
+    failures are logged per image, the failures are also returned as (image, error) tuples.
+    """
+    tasks = {}
+    for i, fit_catalog in enumerate(fit_catalogs):
+        check_images(imagesfolders[i], fit_catalog.query(drawband or None))
+        for date, band, sources in fit_catalog.query(drawband or None):
+            tasks[f"{i}_{date.strftime('%Y-%m-%d')}_{band}"] = (date, band, np.array(sources), imagesfolders[i], output, contours, i)
+
+    failures = []
+    # spawn rather than fork, workers should not inherit the interactive pyplot state
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"), initializer=_init_render_worker, initargs=(rms_csvs,)) as executor:
+        futures = {executor.submit(_render_sources, *task): name for name, task in tasks.items()}
+        for n, future in enumerate(as_completed(futures), 1):
+            name = futures[future]
+            try:
+                error = future.result()
+            except Exception as e: # the worker itself died
+                error = f"{type(e).__name__}: {e}"
+            if error:
+                failures.append((name, error))
+                logger.warning(f"[{n}/{len(tasks)}] {name} failed: {error}")
+            else:
+                logger.info(f"[{n}/{len(tasks)}] {name} rendered")
+    logger.info(f"Rendered {len(tasks) - len(failures)}/{len(tasks)} images to {output}")
+    profiling.count("batch_render", figures=len(tasks) - len(failures), failures=len(failures))
+    return failures
+
+def read_listdate(listdate: Optional[Path]) -> Optional[np.ndarray]:
+    """Read the MJD listed one per line in listdate, None if there is no list"""
+    if listdate is None:
+        return None
+    return np.loadtxt(listdate, ndmin=1)
+
+# metrics of the time series, each takes the sources of one epoch and the index of the main source (None for
+# settings.TARGET) and returns the (values, errors) to plot, nan meaning the epoch has no value
+def _main_source(sources: np.ndarray, m: Optional[int]):
+    return settings.TARGET if m is None else sources[m]
+
+def _others(sources: np.ndarray, m: Optional[int]) -> np.ndarray:
+    return sources if m is None else sources[np.arange(len(sources)) != m]
+
+def angsep_metric(sources: np.ndarray, m: Optional[int], strategy: str) -> tuple[np.ndarray, np.ndarray]:
+    main, others = _main_source(sources, m), _others(sources, m)
+    sep, err = utils.angsep_batch(*utils.radians(main), *utils.radians(others))
+    # sources on the left of the main source get a negative separation
+    sign = np.where(others["ra"] > utils.to_deg(main["ra"]), -1, 1)
+    return sign*utils.arcsec(sep), utils.arcsec(err)
+
+def rasep_metric(sources: np.ndarray, m: Optional[int], strategy: str) -> tuple[np.ndarray, np.ndarray]:
+    main_ra, main_ra_err, _, _ = utils.radians(_main_source(sources, m))
+    ra, ra_err, _, _ = utils.radians(_others(sources, m))
+    sep, err = utils.rasep_batch(main_ra, main_ra_err, ra, ra_err)
+    return utils.arcsec(sep), utils.arcsec(err)
+
+def flux_metric(sources: np.ndarray, m: Optional[int], strategy: str) -> tuple[np.ndarray, np.ndarray]:
+    if m is None:
+        raise ValueError("the flux of the reference position is unknown")
+    return sources["flux"][m:m+1], sources["flux_err"][m:m+1]
+
+def angsep_brightest_metric(sources: np.ndarray, m: Optional[int], strategy: str) -> tuple[np.ndarray, np.ndarray]:
+    not_main = np.ones(len(sources), dtype=bool) if m is None else np.arange(len(sources)) != m
+    if strategy == "is_main":
+        not_main &= sources["is_main"] != 1
+    if not not_main.any():
+        return np.array([np.nan]), np.array([np.nan]) # drawn as a red point at 0
+    candidates = np.flatnonzero(not_main)
+    b = candidates[np.argmax(sources["flux"][candidates])] # brightest of the not main sources
+    sep, err = utils.angsep_batch(*utils.radians(_main_source(sources, m)), *utils.radians(sources[b:b+1]))
+    return utils.arcsec(sep), utils.arcsec(err)
+
+# name: (metric, y axis label), the name is also the prefix of the saved figures
+METRICS = {
+    "angsep": (angsep_metric, "Angular separation (as)"),
+    "rasep": (rasep_metric, "RA Separation (as)"),
+    "flux": (flux_metric, f"Flux ({FLUX_UNIT})"),
+    "angsep_brightest": (angsep_brightest_metric, "Angular separation vs brightest (as)"),
+}
+
+def strategy(leftmost=False, rightmost=False, reference=False) -> str:
+    """Name of the main source strategy selected by the command line flags"""
+    return "leftmost" if leftmost else "rightmost" if rightmost else "reference" if reference else "is_main"
+
+def series(fit_catalog: Catalog, band_chosen: str, metric: str, strategy="is_main", maxdate=None, mjds=None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Compute the (mjd, value, error) arrays of a metric over the epochs of a catalog"""
+    function = METRICS[metric][0]
+    mjd, values, errors = [], [], []
+    undecided = 0
+    for epoch, sources in fit_catalog.query(band_chosen, stop=maxdate, mjds=mjds).epochs():
+        if strategy == "is_main" and not (sources["is_main"] == 1).any():
+            undecided += 1 # e.g. just ingested by --watch, getmain has not been asked yet
+            continue
+        m = None if strategy == "reference" else main_index(sources, strategy == "leftmost", strategy == "rightmost")
+        value, error = function(sources, m, strategy)
+        mjd.append(np.full(len(value), epoch))
+        values.append(value)
+        errors.append(error)
+    if undecided:
+        logger.warning(f"{undecided} epochs of {band_chosen}band without a main source are left out of the {metric}, use --getmain to choose it")
+    if not mjd:
+        return np.empty(0), np.empty(0), np.empty(0)
+    return np.concatenate(mjd), np.concatenate(values), np.concatenate(errors)
+
+@profiling.timed("series")
+def draw_series(fit_catalogs: list[Catalog], band_chosen: str, metric: str, output: Path, strategy="is_main", maxdate=None, listdate=None):
+    """Plot a metric against time, one errorbar call per dataset, and save the figure"""
+    mjds = read_listdate(listdate)
     plt.figure(1)
-    logger.info("drawrasep")
-    if listdate is not None: # on ouvre le fichier qu'une seule fois au lieu d'à chaque item
-        with open(listdate) as f :
-            list_dates = f.readlines() 
-    for i, fit_dict in enumerate(fit_dicts):
-        for date, bands in fit_dict.items():
-            if maxdate and Time(date).mjd > maxdate :
-                continue
-            if listdate and Time(date).mjd not in list_dates: # et là faut convertir la date en mjd
-                continue
-            for band, sourcesdata in bands.items():
-                if band != band_chosen:
-                    continue
-                if leftmost:
-                    sourcesdata["sources"].sort(key=lambda x: x["ra"], reverse=True)
-                    main_source = sourcesdata["sources"][0]
-                elif rightmost:
-                    sourcesdata["sources"].sort(key=lambda x: x["ra"])
-                    main_source = sourcesdata["sources"][0]
-                elif reference:
-                    main_source = settings.TARGET
-                else:
-                    main_source = list(filter(lambda x: int(x["is_main"]) == 1, sourcesdata["sources"]))[0]
-                
-                for source in sourcesdata["sources"]:
-                    if source == main_source:
-                        continue
-                    sep = utils.rasep(
-                        main_source["ra"], main_source["ra_err"],
-                        source["ra"], source["ra_err"], 
-                    )
-                    logger.info(f"{Time(date).mjd}, {sep[0].arcsec}")
-                    plt.errorbar(Time(date).mjd, sep[0].arcsec, yerr=sep[1].arcsec,marker="o",color=settings.COLORS[i%len(settings.COLORS)], ecolor='black', linestyle='', capsize=1, elinewidth=0.5, markeredgewidth=0.3, markersize=3, markeredgecolor='black')
-
-
-    plt.ylabel("RA Separation (as)")
+    style = dict(ecolor='black', linestyle='', capsize=1, elinewidth=0.5, markeredgewidth=0.3, markersize=3, markeredgecolor='black')
+    missing = []
+    for i, fit_catalog in enumerate(fit_catalogs):
+        mjd, values, errors = series(fit_catalog, band_chosen, metric, strategy, maxdate, mjds)
+        logger.debug(f"{metric} of dataset {i}: {len(mjd)} points")
+        valid = ~np.isnan(values)
+        missing.append(mjd[~valid])
+        plt.errorbar(mjd[valid], values[valid], yerr=errors[valid], marker="o", color=settings.COLORS[i%len(settings.COLORS)], **style)
+    missing = np.concatenate(missing)
+    if len(missing):
+        plt.errorbar(missing, np.zeros(len(missing)), yerr=np.zeros(len(missing)), marker="o", color="red", **style)
+
+    from astropy.time import Time # only used to format the ticks
+    plt.ylabel(METRICS[metric][1])
     plt.xlabel("Date")
     plt.minorticks_on()
     plt.tick_params(axis='both',which='both',direction = 'in', top=True, right=True)#, labelsize = 12)
     plt.xticks(rotation=90)
     plt.gca().xaxis.set_major_formatter(mpl.ticker.FuncFormatter(lambda x,_: f"({Time(x,format='mjd').to_value('iso', subfmt='date')}) {x}"))
-    plt.savefig(output / f"rasep_{band_chosen}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}{'left' if leftmost else 'right' if rightmost else 'reference' if reference else ''}.jpg",bbox_inches='tight',dpi=300)
-    plt.savefig(output / f"rasep_{band_chosen}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}{'left' if leftmost else 'right' if rightmost else 'reference' if reference else ''}.pdf",bbox_inches='tight')
+    name = f"{metric}_{band_chosen}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}{'' if strategy == 'is_main' else strategy.replace('most', '')}"
+    with profiling.span("savefig", figures=2):
+        plt.savefig(output / f"{name}.jpg",bbox_inches='tight',dpi=300)
+        plt.savefig(output / f"{name}.pdf",bbox_inches='tight')
+    if profiling.enabled:
+        profiling.count("savefig", bytes=sum((output / f"{name}.{ext}").stat().st_size for ext in ("jpg", "pdf")))
+    profiling.count("series", figures=1)
     plt.show()
 
+def draw_angsep(fit_catalogs: list[Catalog], band_chosen: str, output: Path, leftmost=False, rightmost=False, maxdate=None, listdate=None):
+    draw_series(fit_catalogs, band_chosen, "angsep", output, strategy(leftmost, rightmost), maxdate, listdate)
 
-def draw_flux(fit_dicts: dict, band_chosen: str, output: Path, leftmost=False, rightmost=False, maxdate=None, listdate=None):
-    if listdate is not None: # on ouvre le fichier qu'une seule fois au lieu d'à chaque item
-        with open(listdate) as f :
-            list_dates = f.readlines() 
-    for i, fit_dict in enumerate(fit_dicts):
-        for date, bands in fit_dict.items():
-            if maxdate and Time(date).mjd > maxdate :
-                continue
-            if listdate and Time(date).mjd not in list_dates: # et là faut convertir la date en mjd
-                continue
-            for band, sourcesdata in bands.items():
-                plt.figure(1)
-                if band != band_chosen:
-                    continue
-                if leftmost:
-                    sourcesdata["sources"].sort(key=lambda x: x["ra"], reverse=True)
-                    main_source = sourcesdata["sources"][0]
-                elif rightmost:
-                    sourcesdata["sources"].sort(key=lambda x: x["ra"])
-                    main_source = sourcesdata["sources"][0]
-                else:
-                    main_source = list(filter(lambda x: int(x["is_main"]) == 1, sourcesdata["sources"]))[0]
-                plt.errorbar(Time(date).mjd, main_source["flux"], yerr=main_source["flux_err"],marker="o",color=settings.COLORS[i%len(settings.COLORS)], ecolor='black', linestyle='', capsize=1, elinewidth=0.5, markeredgewidth=0.3, markersize=3, markeredgecolor='black')
-    plt.ylabel("Flux (mJy)")
-    plt.xlabel("Date")
-    plt.minorticks_on()
-    plt.tick_params(axis='both',which='both',direction = 'in', top=True, right=True)#, labelsize = 12)
-    plt.xticks(rotation=90)
-    plt.gca().xaxis.set_major_formatter(mpl.ticker.FuncFormatter(lambda x,_: f"({Time(x,format='mjd').to_value('iso', subfmt='date')}) {x}"))
-    plt.savefig(output / f"flux_{band_chosen}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}{'left' if leftmost else 'right' if rightmost else ''}.jpg",bbox_inches='tight',dpi=300)
-    plt.savefig(output / f"flux_{band_chosen}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}{'left' if leftmost else 'right' if rightmost else ''}.pdf",bbox_inches='tight')
-    plt.show()
+def draw_rasep(fit_catalogs: list[Catalog], band_chosen: str, output: Path, leftmost=False, rightmost=False, reference=False, maxdate=None, listdate=None):
+    draw_series(fit_catalogs, band_chosen, "rasep", output, strategy(leftmost, rightmost, reference), maxdate, listdate)
 
+def draw_flux(fit_catalogs: list[Catalog], band_chosen: str, output: Path, leftmost=False, rightmost=False, maxdate=None, listdate=None):
+    draw_series(fit_catalogs, band_chosen, "flux", output, strategy(leftmost, rightmost), maxdate, listdate)
 
-def draw_angsep_brightest(fit_dicts: list[dict], band_chosen: str, output: Path, leftmost=False, rightmost=False, maxdate=None, listdate=None):
-    if listdate is not None: # on ouvre le fichier qu'une seule fois au lieu d'à chaque item
-        with open(listdate) as f :
-            list_dates = f.readlines() 
-    for i, fit_dict in enumerate(fit_dicts):
-        for date, bands in fit_dict.items():
-            if maxdate and Time(date).mjd > maxdate :
-                continue
-            if listdate and Time(date).mjd not in list_dates: # et là faut convertir la date en mjd
-                continue
-            for band, sourcesdata in bands.items():
-                plt.figure(1)
-                if band != band_chosen:
-                    continue
-                if leftmost:
-                    sourcesdata["sources"].sort(key=lambda x: x["ra"], reverse=True)
-                    main_source = sourcesdata["sources"][0]
-                    not_main_sources = sourcesdata["sources"][1:]
-                elif rightmost:
-                    sourcesdata["sources"].sort(key=lambda x: x["ra"])
-                    main_source = sourcesdata["sources"][0]
-                    not_main_sources = sourcesdata["sources"][1:]
-                else:
-                    main_source = list(filter(lambda x: int(x["is_main"]) == 1, sourcesdata["sources"]))[0]
-                    not_main_sources = list(filter(lambda x: int(x["is_main"]) != 1, sourcesdata["sources"]))
-
-                not_main_sources.sort(key=lambda x: x["flux"], reverse=True)
-                if len(not_main_sources) == 0:
-                #    continue # si tu veux juste ne rien faire
-                # ou alors
-                    plt.errorbar(Time(date).mjd, 0, yerr=0,marker="o",color="red", ecolor='black', linestyle='', capsize=1, elinewidth=0.5, markeredgewidth=0.3, markersize=3, markeredgecolor='black') 
-                    continue # si tu veux mettre un point à 0
-                source = not_main_sources[0]
-                sep = utils.angsep(
-                        main_source["ra"], main_source["ra_err"], main_source["dec"], main_source["dec_err"],
-                        source["ra"], source["ra_err"], source["dec"], source["dec_err"],
-                    )
-                plt.errorbar(Time(date).mjd, sep[0].arcsec, yerr=sep[1].arcsec,marker="o",color=settings.COLORS[i%len(settings.COLORS)], ecolor='black', linestyle='', capsize=1, elinewidth=0.5, markeredgewidth=0.3, markersize=3, markeredgecolor='black')
-
-    plt.ylabel("Angular separation vs brightest (as)")
-    plt.xlabel("Date")
-    plt.minorticks_on()
-    plt.tick_params(axis='both',which='both',direction = 'in', top=True, right=True)#, labelsize = 12)
-    plt.xticks(rotation=90)
-    plt.gca().xaxis.set_major_formatter(mpl.ticker.FuncFormatter(lambda x,_: f"({Time(x,format='mjd').to_value('iso', subfmt='date')}) {x}"))
-    plt.savefig(output / f"angsep_brightest_{band_chosen}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}{'left' if leftmost else 'right' if rightmost else ''}.jpg",bbox_inches='tight',dpi=300)
-    plt.savefig(output / f"angsep_brightest_{band_chosen}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}{'left' if leftmost else 'right' if rightmost else ''}.pdf",bbox_inches='tight')
-    plt.show()
+def draw_angsep_brightest(fit_catalogs: list[Catalog], band_chosen: str, output: Path, leftmost=False, rightmost=False, maxdate=None, listdate=None):
+    draw_series(fit_catalogs, band_chosen, "angsep_brightest", output, strategy(leftmost, rightmost), maxdate, listdate)
 
 
-def getmain(date: datetime.date, band: str, sources: list, imagesfolder:Path, output: Path, contours: bool, save: bool, data_index: int):
+def getmain(date: datetime.date, band: str, sources: np.ndarray, imagesfolder:Path, output: Path, contours: bool, save: bool, data_index: int, preview=False):
     fig = draw_sources(
         date=date, 
         band=band, 
@@ -324,18 +389,75 @@ def getmain(date: datetime.date, band: str, sources: list, imagesfolder:Path, ou
         output=output, 
         contours=contours, 
         save=save,
-        data_index=data_index
+        data_index=data_index,
+        preview=preview
     )
     if fig:
-        plt.ion()
-        plt.show()
-        main_source = int(input("Main source: "))
-        plt.close()
-        for i, source in enumerate(sources):
-            if i == main_source:
-                source["is_main"] = 1
-            else:
-                source["is_main"] = 0
-        return sources
+        return ask_main(sources)
     return None
 
+def ask_main(sources: np.ndarray) -> np.ndarray:
+    """Show the current figure, ask for the index of the main source and set is_main in sources"""
+    plt.ion()
+    plt.show()
+    main_source = int(input("Main source: "))
+    plt.close()
+    sources["is_main"] = np.arange(len(sources)) == main_source
+    return sources
+
+def _render_png(date: datetime.date, band: str, sources: np.ndarray, imagesfolder: Path, output: Path, contours: bool, save: bool, data_index: int, preview: bool) -> Optional[bytes]:
+    """Draw a figure in a worker and return it as png, None if there is no image"""
+    fig = draw_sources(date, band, sources, imagesfolder, output, contours, save, data_index, preview)
+    if fig is None:
+        return None
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", dpi=100)
+    plt.close(fig)
+    return buffer.getvalue()
+
+def prefetch_renders(groups: Iterable[tuple], imagesfolder: Path, output: Path, contours: bool, save: bool, data_index: int, rms_csvs: list[Path], ahead=4, workers=None, preview=False) -> Iterator[tuple[tuple, Optional[bytes]]]:
+    """Yield each (date, band, sources) of groups with its figure as png, in order
+
+    A pool of headless workers draws up to ahead figures in advance, so they are ready by the time
+    the previous ones are dealt with. groups is only consumed as figures are submitted.
+    """
+    groups = iter(groups)
+    pending = collections.deque()
+    # spawn rather than fork, workers should not inherit the interactive pyplot state
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"), initializer=_init_render_worker, initargs=(rms_csvs,))
+
+    def submit(group):
+        date, band, sources = group
+        future = executor.submit(_render_png, date, band, np.array(sources), imagesfolder, output, contours, save, data_index, preview)
+        pending.append((group, future))
+
+    try:
+        for group in itertools.islice(groups, ahead):
+            submit(group)
+        while pending:
+            group, future = pending.popleft()
+            for next_group in itertools.islice(groups, 1):
+                submit(next_group)
+            try:
+                png = future.result()
+            except Exception as e:
+                logger.warning(f"Could not draw {group[0]:%Y-%m-%d} {group[1]}: {type(e).__name__}: {e}")
+                png = None
+            yield group, png
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True) # the session may stop before every figure is used
+
+def getmain_prefetched(groups: Iterable[tuple], imagesfolder: Path, output: Path, contours: bool, save: bool, data_index: int, rms_csvs: list[Path], ahead=4, workers=None, preview=False) -> Iterator[tuple[datetime.datetime, str, Optional[np.ndarray]]]:
+    """getmain over groups, yield (date, band, sources) with is_main set, sources being None without a figure
+
+    Figures are drawn ahead by prefetch_renders, only the ready png is shown while waiting for input.
+    """
+    for (date, band, sources), png in prefetch_renders(groups, imagesfolder, output, contours, save, data_index, rms_csvs, ahead, workers, preview):
+        if png is None:
+            yield date, band, None
+            continue
+        fig = plt.figure(figsize=(8, 8))
+        ax = fig.add_axes([0, 0, 1, 1])
+        ax.imshow(plt.imread(io.BytesIO(png), format="png"))
+        ax.set_axis_off()
+        yield date, band, ask_main(sources)
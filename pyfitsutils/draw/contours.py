@@ -0,0 +1,42 @@
+import logging
+
+from pathlib import Path
+
+import contourpy
+import numpy as np
+
+from pyfitsutils import settings
+from pyfitsutils.cache import DiskCache, file_key
+from pyfitsutils.draw.cutouts import WINDOW_MARGIN, read_window
+
+logger = logging.getLogger(__name__)
+
+cache = DiskCache(settings.CONTOUR_CACHE, settings.CONTOUR_CACHE_MAX_SIZE)
+
+
+def compute_contours(img: Path, levels: list[float], ra: float, dec: float, radius: float) -> list[np.ndarray]:
+    """Contour the window of img around (ra, dec), return the lines as 2xN arrays of world coordinates"""
+    window, wcs, _ = read_window(img, ra, dec, radius)
+    generator = contourpy.contour_generator(z=np.ma.masked_invalid(window.astype(float)), line_type=contourpy.LineType.Separate)
+    lines = [line for level in levels for line in generator.lines(level)]
+    if not lines:
+        return []
+    points = np.concatenate(lines)
+    world = np.array(wcs.pixel_to_world_values(points[:, 0], points[:, 1]))
+    return np.split(world, np.cumsum([len(line) for line in lines])[:-1], axis=1)
+
+def contour_lines(img: Path, levels: list[float], ra: float, dec: float, radius: float) -> list[np.ndarray]:
+    """Cached compute_contours, keyed by the image file, the levels and the region"""
+    key = cache.key(file_key(img), [float(level) for level in levels], ra, dec, radius, WINDOW_MARGIN)
+    path = cache.get(key)
+    if path is not None:
+        logger.info(f"Using cached contours of {img}")
+        with np.load(path) as data:
+            return np.split(data["points"], data["splits"], axis=1)
+
+    logger.info(f"Computing contours of {img}")
+    lines = compute_contours(img, levels, ra, dec, radius)
+    points = np.concatenate(lines, axis=1) if lines else np.empty((2, 0))
+    splits = np.cumsum([line.shape[1] for line in lines])[:-1]
+    cache.put(key, lambda f: np.savez(f, points=points, splits=splits))
+    return lines
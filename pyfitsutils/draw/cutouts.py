@@ -0,0 +1,72 @@
+import contextlib
+import logging
+
+from pathlib import Path
+from typing import Iterator, Tuple
+
+import numpy as np
+
+from astropy.io import fits
+from astropy.wcs import WCS
+from astropy.wcs.utils import proj_plane_pixel_scales
+
+from pyfitsutils import settings
+from pyfitsutils.cache import DiskCache, file_key
+
+logger = logging.getLogger(__name__)
+
+# part of the image kept around the center, relative to the radius shown by recenter
+WINDOW_MARGIN = 1.2
+# header cards of the full image kept in the cutouts
+KEPT_CARDS = ["OBJECT", "TELESCOP", "DATE-OBS", "BUNIT", "BMAJ", "BMIN", "BPA"]
+
+cache = DiskCache(settings.CUTOUT_CACHE, settings.CUTOUT_CACHE_MAX_SIZE, suffix=".fits")
+
+
+def image_window(wcs: WCS, shape: Tuple[int, int], ra: float, dec: float, radius: float) -> Tuple[int, int, int, int]:
+    """Return the (x0, x1, y0, y1) pixel window of an image covering radius degrees around (ra, dec)"""
+    x, y = wcs.world_to_pixel_values(ra, dec)
+    half = WINDOW_MARGIN * radius / proj_plane_pixel_scales(wcs) + 1
+    x0, x1 = int(max(np.floor(x - half[0]), 0)), int(min(np.ceil(x + half[0]) + 1, shape[1]))
+    y0, y1 = int(max(np.floor(y - half[1]), 0)), int(min(np.ceil(y + half[1]) + 1, shape[0]))
+    return x0, x1, y0, y1
+
+@contextlib.contextmanager
+def open_image(img: Path) -> Iterator[Tuple[np.ndarray, WCS, fits.Header]]:
+    """Open img memory mapped, yield its 2-D pixels with their celestial WCS and the image header
+
+    Pixels are only read when used, and only while the file is open.
+    """
+    with fits.open(img, memmap=True) as hdul:
+        header = hdul[0].header
+        data = hdul[0].data
+        while data.ndim > 2: # radio images have degenerate frequency and stokes axes
+            data = data[0]
+        yield data, WCS(header).celestial, header
+
+def image_hdu(data: np.ndarray, wcs: WCS, header: fits.Header) -> fits.PrimaryHDU:
+    """HDU of data (a part of the image of header) described by wcs and the KEPT_CARDS of header"""
+    hdu_header = wcs.to_header()
+    for card in KEPT_CARDS:
+        if card in header:
+            hdu_header[card] = header[card]
+    return fits.PrimaryHDU(data, header=hdu_header)
+
+def read_window(img: Path, ra: float, dec: float, radius: float) -> Tuple[np.ndarray, WCS, fits.Header]:
+    """Read only the pixels of img around (ra, dec), return them with their celestial WCS and the image header"""
+    with open_image(img) as (data, wcs, header):
+        x0, x1, y0, y1 = image_window(wcs, data.shape, ra, dec, radius)
+        window = np.array(data[y0:y1, x0:x1])
+    return window, wcs[y0:y1, x0:x1], header
+
+def cutout(img: Path, ra: float, dec: float, radius: float) -> Path:
+    """Return a FITS file holding the part of img around (ra, dec), extracted once and cached on disk"""
+    key = cache.key(file_key(img), ra, dec, radius, WINDOW_MARGIN)
+    path = cache.get(key)
+    if path is not None:
+        logger.info(f"Using cached cutout of {img}")
+        return path
+
+    logger.info(f"Extracting cutout of {img}")
+    hdu = image_hdu(*read_window(img, ra, dec, radius))
+    return cache.put(key, hdu.writeto)
@@ -0,0 +1,77 @@
+import logging
+import warnings
+
+from pathlib import Path
+
+import numpy as np
+
+from astropy.wcs.utils import proj_plane_pixel_scales
+
+from pyfitsutils import settings
+from pyfitsutils.cache import DiskCache, file_key
+from pyfitsutils.draw.cutouts import WINDOW_MARGIN, image_hdu, open_image
+
+logger = logging.getLogger(__name__)
+
+# each level averages 2x2 blocks of the one below, the pyramid stops before a level gets smaller than this
+PYRAMID_MIN_SIZE = 64
+# a preview keeps at least this many pixels across the region it shows
+PREVIEW_PIXELS = 400
+
+cache = DiskCache(settings.PREVIEW_CACHE, settings.PREVIEW_CACHE_MAX_SIZE, suffix=".fits")
+
+
+def block_mean(data: np.ndarray, factor: int) -> np.ndarray:
+    """Average factor x factor blocks of data, ignoring nan, the rows and columns left over are dropped"""
+    ny, nx = data.shape[0] // factor, data.shape[1] // factor
+    blocks = data[:ny * factor, :nx * factor].reshape(ny, factor, nx, factor)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning) # blocks only made of nan stay nan
+        return np.nanmean(blocks, axis=(1, 3))
+
+def levels(shape: tuple[int, int]) -> int:
+    """Number of levels of the pyramid of an image of this shape, the full image being level 0"""
+    n = 0
+    while min(shape) // 2**(n + 1) >= PYRAMID_MIN_SIZE:
+        n += 1
+    return n
+
+def pyramid(img: Path) -> list[Path]:
+    """Return the FITS files of the levels 1, 2... of img, built once and cached on disk
+
+    Level k averages 2**k x 2**k pixel blocks, its WCS is the one of the image sliced with this step
+    so that a pixel is centered on its block.
+    """
+    image_key = file_key(img)
+    with open_image(img) as (data, wcs, header):
+        paths = [cache.get(cache.key(image_key, level)) for level in range(1, levels(data.shape) + 1)]
+        if all(paths):
+            return paths
+
+        logger.info(f"Building the preview pyramid of {img}")
+        level_data = np.asarray(data, dtype=np.float32)
+        for level in range(1, len(paths) + 1):
+            level_data = block_mean(level_data, 2) # averages of averages of full blocks are the block averages
+            if paths[level - 1] is not None:
+                continue
+            step = 2**level
+            hdu = image_hdu(level_data, wcs[::step, ::step], header)
+            paths[level - 1] = cache.put(cache.key(image_key, level), hdu.writeto)
+    return paths
+
+def preview_level(pixel_scale: float, radius: float, n_levels: int) -> int:
+    """Coarsest level keeping PREVIEW_PIXELS pixels across the 2 * radius region drawn around the target"""
+    pixels = 2 * WINDOW_MARGIN * radius / pixel_scale
+    level = int(np.floor(np.log2(max(pixels / PREVIEW_PIXELS, 1))))
+    return min(level, n_levels)
+
+def preview_image(img: Path, radius: float) -> Path:
+    """Return the image to draw a preview of radius degrees from, img itself or a level of its pyramid"""
+    with open_image(img) as (data, wcs, _):
+        shape = data.shape
+    pixel_scale = float(np.min(proj_plane_pixel_scales(wcs)))
+    level = preview_level(pixel_scale, radius, levels(shape))
+    if level == 0:
+        return img
+    logger.info(f"Using level {level} of the preview pyramid of {img}")
+    return pyramid(img)[level - 1]
@@ -1,44 +1,70 @@
 import datetime
+import itertools
 import logging
+import os
 import re
+import time
 
+from concurrent.futures import ProcessPoolExecutor
 from decimal import Decimal
 from pathlib import Path
-from typing import Any, Tuple
+from typing import Any, Iterator, Optional, Tuple
 
 
-from astropy.coordinates import Angle
+import numpy as np
 
-from . import utils
+from . import catalog, profiling, utils
+from .catalog import Catalog
+from .manifest import Manifest
 
 logger = logging.getLogger()
 
 class Fit:
 
     SOURCE_LEN = 7
+    BINARY_SUFFIX = ".npy"
+
+    FILE_PATTERN = re.compile(r"_(?P<date>[0-9a-zA-Z]+)_(?P<band>[A-Za-z]+)band")
+    RA_PATTERN = re.compile(r"(?P<value>[0-9:\.]+)\s\+\/\-\s(?P<error>[0-9\.]+)\ss")
+    DEC_PATTERN = re.compile(r"(?P<value>\-?[0-9\.]+)\s\+\/\-\s(?P<error>[0-9\.]+)\sarcsec")
+    BEAM_PATTERN = re.compile(r"(?P<value>\-?[0-9\.]+)\sarcsec")
+    FLUX_PATTERN = re.compile(r"(?P<value>[0-9\.]+)\s\+\/\-\s(?P<error>[0-9\.]+\s[mu])Jy")
+    FREQ_PATTERN = re.compile(r"(?P<value>[0-9\.]+)\sGHz")
+    # decimal exponent taking a flux with this unit prefix to catalog.FLUX_UNIT, applied on the digits so the value is rounded once
+    FLUX_EXPONENTS = {"u": "e-3", "m": ""}
+
+    # fields (degrees and mJy) of a source are considered equal within this tolerance when merging, which
+    # absorbs the rounding of the csv formatting
+    MATCH_TOLERANCE = {"ra": 1e-9, "ra_err": 1e-9, "dec": 1e-9, "dec_err": 1e-9, "flux": 1e-9, "flux_err": 1e-9}
+    MATCH_KEYS = ["ra", "dec", "flux"]
+    NEIGHBOUR_CELLS = [offset for offset in itertools.product((-1, 0, 1), repeat=3) if any(offset)]
 
     @classmethod
     def block2source_dict(cls, block: list[str]) -> Tuple[dict[str, str], dict[str, str]]:
-        """Take a block for a measurement in a fit file an return the corresponding dictionary"""
+        """Take a block for a measurement in a fit file an return the corresponding dictionary
+
+        Not used to load catalogs any more, kept as the astropy reference iter_records is tested against.
+        """
+        from astropy.coordinates import Angle
         source_dict = {"is_main": ""}
         band_dict = {}
         for i, line in enumerate(block):
             line = line.strip()
             if line.startswith("--- ra:") and not line.endswith("pixels"):
-                matches = re.search(r"(?P<value>[0-9:\.]+)\s\+\/\-\s(?P<error>[0-9\.]+)\ss", line)
+                matches = cls.RA_PATTERN.search(line)
                 source_dict["ra"] = Angle(matches.group("value"), "hourangle")
                 source_dict["ra_err"] = Angle("00:00:" + matches.group("error"), "hourangle")
             elif line.startswith("--- dec:") and not line.endswith("pixels"):
-                matches = re.search(r"(?P<value>\-?[0-9\.]+)\s\+\/\-\s(?P<error>[0-9\.]+)\sarcsec", line)
+                matches = cls.DEC_PATTERN.search(line)
                 source_dict["dec"] = Angle(utils.convert_dec(matches.group("value")), "deg")
                 source_dict["dec_err"] = Angle("00:00:" + matches.group("error"), "deg")
             elif line.startswith("Clean beam size"):
-                matches = re.search(r"(?P<value>\-?[0-9\.]+)\sarcsec", block[i+1].strip())
+                matches = cls.BEAM_PATTERN.search(block[i+1].strip())
                 band_dict["major"] = matches.group("value")
-                matches = re.search(r"(?P<value>\-?[0-9\.]+)\sarcsec", block[i+2].strip())
+                matches = cls.BEAM_PATTERN.search(block[i+2].strip())
                 band_dict["minor"] = matches.group("value")
             elif line.startswith("--- Integrated:"):
-                matches = re.search(r"(?P<value>[0-9\.]+)\s\+\/\-\s(?P<error>[0-9\.]+\s[mu])Jy", line)
+                matches = cls.FLUX_PATTERN.search(line)
                 if matches.group("error").endswith("u"):
                     source_dict["flux"] = Decimal(matches.group("value"))/1000
                     source_dict["flux_err"] = Decimal(matches.group("error").strip("u "))/1000
@@ -46,153 +72,350 @@ class Fit:
                     source_dict["flux"] = Decimal(matches.group("value"))
                     source_dict["flux_err"] = Decimal(matches.group("error").strip("m "))
             elif line.startswith("--- frequency:"):
-                matches = re.search(r"(?P<value>[0-9\.]+)\sGHz", line)
+                matches = cls.FREQ_PATTERN.search(line)
                 band_dict["freq"] = matches.group("value")
         return source_dict, band_dict 
 
+    @classmethod
+    def file_metadata(cls, fit_file: Path) -> Tuple[datetime.datetime, str]:
+        """Return the (date, band) of a fit file from its name"""
+        matches = cls.FILE_PATTERN.search(fit_file.as_posix())
+        return datetime.datetime.strptime(matches.group("date"), "%d%b%Y"), matches.group("band")
+
+    @classmethod
+    def iter_records(cls, fit_file: Path) -> Iterator[tuple]:
+        """Stream the catalog records of a fit file, one per measurement block
+
+        Lines are parsed as they are read, only the fields of the current block are kept in memory.
+        Values are converted straight to floats (degrees and mJy). They agree with the Angle and
+        Decimal objects of block2source_dict to float rounding: ra and dec may differ in the last ulp.
+        """
+        fit_date, fit_freq = cls.file_metadata(fit_file)
+        date = catalog.to_datetime64(fit_date)
+        fields = None
+        beam_axes = [] # axes still to read after a "Clean beam size" line
+        n_lines = 0
+        start = time.perf_counter()
+        with open(fit_file) as f:
+            for n_lines, line in enumerate(f, 1):
+                line = line.strip()
+                if line.startswith("Fit on"):
+                    if fields is not None:
+                        yield cls.fields2record(date, fit_freq, fields)
+                    fields = {}
+                    beam_axes = []
+                elif fields is None:
+                    continue
+                elif beam_axes:
+                    fields[beam_axes.pop(0)] = float(cls.BEAM_PATTERN.search(line).group("value"))
+                elif line.startswith("--- ra:") and not line.endswith("pixels"):
+                    matches = cls.RA_PATTERN.search(line)
+                    fields["ra"] = utils.sexagesimal2deg(matches.group("value"), hourangle=True)
+                    fields["ra_err"] = float(matches.group("error")) / 3600.0 * utils.HOURANGLE2DEG
+                elif line.startswith("--- dec:") and not line.endswith("pixels"):
+                    matches = cls.DEC_PATTERN.search(line)
+                    fields["dec"] = utils.sexagesimal2deg(utils.convert_dec(matches.group("value")))
+                    fields["dec_err"] = float(matches.group("error")) / 3600.0
+                elif line.startswith("Clean beam size"):
+                    beam_axes = ["major", "minor"]
+                elif line.startswith("--- Integrated:"):
+                    matches = cls.FLUX_PATTERN.search(line)
+                    value, error = matches.group("value"), matches.group("error")
+                    exponent = cls.FLUX_EXPONENTS[error[-1]]
+                    fields["flux"] = float(value + exponent)
+                    fields["flux_err"] = float(error[:-1].strip() + exponent)
+                elif line.startswith("--- frequency:"):
+                    fields["freq"] = float(cls.FREQ_PATTERN.search(line).group("value"))
+
+            if fields is not None:
+                yield cls.fields2record(date, fit_freq, fields)
+
+        elapsed = time.perf_counter() - start
+        logger.debug(f"Parsed {n_lines} lines of {fit_file} in {elapsed:.3f}s ({n_lines / max(elapsed, 1e-9):.0f} lines/s)")
+
+    @classmethod
+    def fields2record(cls, date: np.datetime64, band: str, fields: dict[str, float]) -> tuple:
+        return (
+            date,
+            band,
+            fields["freq"],
+            fields["major"],
+            fields["minor"],
+            fields["ra"],
+            fields["ra_err"],
+            fields["dec"],
+            fields["dec_err"],
+            fields["flux"],
+            fields["flux_err"],
+            catalog.UNKNOWN,
+        )
+
+    @classmethod
+    def file2rows(cls, fit_file: Path) -> np.ndarray:
+        """Take the path of a fit file and return its catalog rows, a compact array cheap to send between processes"""
+        logger.info(f"Loading fit data from {fit_file}")
+        return np.fromiter(cls.iter_records(fit_file), dtype=catalog.DTYPE)
+
+    @classmethod
+    def folder2catalog(cls, folder: Path, workers: Optional[int] = None) -> Catalog:
+        """Take the path of a folder containing fit files and return the corresponding catalog
+
+        Files are parsed by a pool of workers processes (os.cpu_count() by default, 1 to stay in this
+        process), results are merged in file name order whatever the order they finish in.
+        """
+        return Catalog.concatenate(cls.files2rows(sorted(folder.iterdir()), workers))
+
+    @classmethod
+    @profiling.timed("parse")
+    def files2rows(cls, fit_files: list[Path], workers: Optional[int] = None) -> list[np.ndarray]:
+        """Parse fit files with a pool of workers, return their rows in the order of fit_files"""
+        if workers == 1 or len(fit_files) <= 1:
+            rows = [cls.file2rows(fit_file) for fit_file in fit_files]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                rows = list(executor.map(cls.file2rows, fit_files, chunksize=1))
+        profiling.count("parse", files=len(fit_files), sources=sum(len(r) for r in rows))
+        return rows
+
     @classmethod
     def folder2dict(cls, folder: Path) -> dict[str, Any]:
         """Take the path of a folder containing fit files and return the corresponding dict"""
-        
-        fits_dict = {}
-        for fit_file in folder.iterdir():
-            with open(fit_file) as f:
-                logger.info(f"Loading fit data from {fit_file}")
-                current_block = []
-                for line in f:
-                    line = line.strip()
-                    matches = re.search(r"_(?P<date>[0-9a-zA-Z]+)_(?P<band>[A-Za-z]+)band", fit_file.as_posix())
-                    fit_freq = matches.group("band")
-                    fit_date = datetime.datetime.strptime(matches.group("date"), "%d%b%Y")
-
-                    if not fits_dict.get(fit_date):
-                        fits_dict[fit_date] = {
-                            fit_freq: {}
-                        }
-
-                    if not fits_dict[fit_date].get(fit_freq):
-                        fits_dict[fit_date][fit_freq] = {}
-
-                    if line.startswith("Fit on"):
-                        if current_block:
-                            s_d, b_d = cls.block2source_dict(current_block)
-                            fits_dict[fit_date][fit_freq]["data"] = b_d
-                            if not fits_dict[fit_date][fit_freq].get("sources"):
-                                fits_dict[fit_date][fit_freq]["sources"] = []
-                            fits_dict[fit_date][fit_freq]["sources"].append(s_d)
-                            current_block = []
-                        current_block.append(line)
-
-                    elif current_block:
-                        current_block.append(line)
-
-                if current_block:
-                    s_d, b_d = cls.block2source_dict(current_block)
-                    fits_dict[fit_date][fit_freq]["data"] = b_d
-                    if not fits_dict[fit_date][fit_freq].get("sources"):
-                        fits_dict[fit_date][fit_freq]["sources"] = []
-                    fits_dict[fit_date][fit_freq]["sources"].append(s_d)
-
-        return fits_dict
+        return cls.folder2catalog(folder).to_dict()
+
+    @classmethod
+    @profiling.timed("csv_write")
+    def catalog2csv(cls, fit_catalog: Catalog, csv: Path):
+        """Take a catalog and write it to the specified csv, one line per (date, band), through a temporary file"""
+        logger.info(f"Saving data to {csv}")
+        rows = fit_catalog.rows
+        # format every column at once, then only join strings per line
+        columns = [
+            utils.deg2sexagesimal_batch(rows["ra"], hourangle=True),
+            utils.deg2sexagesimal_batch(rows["ra_err"], hourangle=True),
+            utils.deg2sexagesimal_batch(rows["dec"]),
+            utils.deg2sexagesimal_batch(rows["dec_err"]),
+            [repr(x) for x in rows["flux"].tolist()],
+            [repr(x) for x in rows["flux_err"].tolist()],
+            ["" if x == catalog.UNKNOWN else str(x) for x in rows["is_main"].tolist()],
+        ]
+        sources = [",".join(fields) for fields in zip(*columns)]
+        written = 0
+        # a crash while compacting never leaves a truncated csv behind the journal
+        with utils.atomic_write(csv) as f:
+            for start, stop in zip(fit_catalog.starts, fit_catalog.stops):
+                line = ",".join([
+                    catalog.to_datetime(rows["date"][start]).strftime("%d%b%Y"),
+                    rows["band"][start],
+                    repr(float(rows["freq"][stop-1])),
+                    repr(float(rows["major"][stop-1])),
+                    repr(float(rows["minor"][stop-1])),
+                    *sources[start:stop]
+                ])
+                written += f.write(line + "\n")
+        profiling.count("csv_write", sources=len(rows), bytes=written)
 
     @classmethod
     def dict2csv(cls, fit_dict: dict[str, Any], csv: Path):
         """Take the dict generated by fit_folder_to_dict() and write it to the specified csv"""
-        logger.info(f"Saving data to {csv}")
-        with open(csv, "w") as f:
-            for date, bands in fit_dict.items():
-                for band, data_sources in bands.items():
-                    line = ",".join([
-                        date.strftime("%d%b%Y"),
-                        band,
-                        data_sources["data"]["freq"],
-                        data_sources["data"]["major"],
-                        data_sources["data"]["minor"],
-                        *[",".join([
-                            s["ra"].to_string(sep=":"),
-                            s["ra_err"].to_string(sep=":"),
-                            s["dec"].to_string(sep=":"),
-                            s["dec_err"].to_string(sep=":"),
-                            str(s["flux"]),
-                            str(s["flux_err"]),
-                            str(s["is_main"]),
-                        ]) for s in data_sources["sources"]]
-                    ])
-                    f.write(line + "\n")
+        cls.catalog2csv(Catalog.from_dict(fit_dict), csv)
 
     @classmethod
-    def csv2dict(cls, csv: Path):
-        """Return a fit dict from a specified csv"""
+    @profiling.timed("csv_read")
+    def csv2catalog(cls, csv: Path) -> Catalog:
+        """Return a catalog from a specified csv
+
+        Lines are only split while reading, each column is then converted at once.
+        """
+        dates, bands, band_data, counts = [], [], [], []
+        columns = [[] for _ in range(cls.SOURCE_LEN)]
         with open(csv) as f:
-            fits_dict = {}
             for line in f:
                 line = line.strip().split(",")
-                fit_date = datetime.datetime.strptime(line[0], '%d%b%Y')
-                fit_freq = line[1]
-                if not fits_dict.get(fit_date):
-                    fits_dict[fit_date] = {
-                        fit_freq: {}
-                    }
-                if not fits_dict[fit_date].get(fit_freq):
-                    fits_dict[fit_date][fit_freq] = {}
-                
-                fits_dict[fit_date][fit_freq] ={
-                    "data": dict(zip(["freq", "major", "minor"], line[2:5]))
-                }
-                fits_dict[fit_date][fit_freq]["sources"] = []
-                for i in range(5, len(line[5:]), cls.SOURCE_LEN):
-                    fits_dict[fit_date][fit_freq]["sources"].append(
-                        {
-                            "ra": Angle(line[i], "hourangle"),
-                            "ra_err": Angle(line[i+1] if ":00:" in line[i+1] else "00:00:" + line[i+1], "hourangle"),
-                            "dec": Angle(line[i+2], "deg"),
-                            "dec_err": Angle(line[i+3] if ":00:" in line[i+3] else "00:00:" + line[i+3], "deg"),
-                            "flux": Decimal(line[i+4]),
-                            "flux_err": Decimal(line[i+5]),
-                            "is_main": line[i+6]
-                        }
-                    )
-        return fits_dict
-
-    @classmethod
-    def are_same(cls, d1, d2, ignore_keys=[]):
-        for key, value in d1.items():
-            if key in ignore_keys:
-                continue
-            if d2.get(key) is None:
-                return False
-            if isinstance(value, Angle) and value.deg == d2.get(key).deg:
-                continue
-            elif isinstance(value, Decimal) and not value.compare(d2.get(key)):
-                continue
-            elif d2.get(key) != value:
-                return False
-        return True
+                if line == [""]:
+                    continue
+                n = (len(line) - 5) // cls.SOURCE_LEN
+                dates.append(line[0])
+                bands.append(line[1])
+                band_data.append(line[2:5])
+                counts.append(n)
+                for k, column in enumerate(columns):
+                    column.extend(line[5+k::cls.SOURCE_LEN][:n])
+
+        parsed_dates = {date: catalog.to_datetime64(datetime.datetime.strptime(date, '%d%b%Y')) for date in set(dates)}
+        rows = np.empty(sum(counts), dtype=catalog.DTYPE)
+        rows["date"] = np.repeat(np.array([parsed_dates[date] for date in dates], dtype=rows.dtype["date"]), counts)
+        rows["band"] = np.repeat(np.array(bands, dtype=rows.dtype["band"]), counts)
+        band_data = np.array(band_data, dtype=float).reshape(-1, 3)
+        for k, key in enumerate(catalog.BAND_FIELDS):
+            rows[key] = np.repeat(band_data[:, k], counts)
+        rows["ra"] = utils.sexagesimal2deg_batch(columns[0], hourangle=True)
+        rows["ra_err"] = utils.sexagesimal2deg_batch(columns[1], hourangle=True)
+        rows["dec"] = utils.sexagesimal2deg_batch(columns[2])
+        rows["dec_err"] = utils.sexagesimal2deg_batch(columns[3])
+        rows["flux"] = np.array(columns[4], dtype=float)
+        rows["flux_err"] = np.array(columns[5], dtype=float)
+        rows["is_main"] = [catalog.UNKNOWN if x == "" else int(x) for x in columns[6]]
+        profiling.count("csv_read", sources=len(rows), bytes=csv.stat().st_size)
+        return Catalog(rows)
+
+    @classmethod
+    def csv2dict(cls, csv: Path):
+        """Return a fit dict from a specified csv"""
+        return cls.csv2catalog(csv).to_dict()
+
+    @classmethod
+    def load_catalog(cls, path: Path) -> Catalog:
+        """Load a catalog from a .npy binary file (memory mapped) or from a csv for any other extension"""
+        if path.suffix == cls.BINARY_SUFFIX:
+            return Catalog.load(path)
+        return cls.csv2catalog(path)
+
+    @classmethod
+    def save_catalog(cls, fit_catalog: Catalog, path: Path):
+        """Save a catalog to a .npy binary file or to a csv for any other extension"""
+        if path.suffix == cls.BINARY_SUFFIX:
+            fit_catalog.save(path)
+        else:
+            cls.catalog2csv(fit_catalog, path)
+
+    @classmethod
+    def convert(cls, src: Path, dst: Path):
+        """Convert a catalog between the csv and the binary formats, the format is given by the extension"""
+        cls.save_catalog(cls.load_catalog(src), dst)
+
+    @classmethod
+    def match_keys(cls, rows: np.ndarray) -> list[tuple]:
+        """Return the (date, band, ra, dec, flux) keys indexing sources, values quantized by MATCH_TOLERANCE"""
+        return list(zip(
+            rows["date"].view(np.int64).tolist(),
+            rows["band"].tolist(),
+            *(np.floor(rows[key] / cls.MATCH_TOLERANCE[key]).astype(np.int64).tolist() for key in cls.MATCH_KEYS),
+        ))
+
+    @classmethod
+    @profiling.timed("merge")
+    def merge_catalogs(cls, new_catalog: Catalog, old_catalog: Catalog) -> Catalog:
+        """Carry the is_main annotations of old_catalog over the matching sources of new_catalog
+
+        Old sources are indexed by their quantized (date, band, ra, dec, flux), a new source is then
+        looked up in its own cell, and in the neighbouring ones when a value sits on a cell border.
+        A match must be within MATCH_TOLERANCE on every field, which absorbs the rounding of the csv,
+        and only a unique match is used.
+        """
+        if len(old_catalog) == 0:
+            return new_catalog
+        old, new = old_catalog.rows, new_catalog.rows
+        index = {}
+        for i, key in enumerate(cls.match_keys(old)):
+            index.setdefault(key, []).append(i)
+        old_groups = {key[:2] for key in index}
+
+        fields = [key for key in catalog.SOURCE_FIELDS if key != "is_main"]
+        tolerance = [cls.MATCH_TOLERANCE[key] for key in fields]
+        # plain python floats, much faster than numpy for a handful of values
+        old_values = np.column_stack([old[key] for key in fields]).tolist()
+        new_values = np.column_stack([new[key] for key in fields]).tolist()
+
+        def close(i, j):
+            if old_values[i] == new_values[j]:
+                return True
+            return all(abs(a - b) <= t for a, b, t in zip(old_values[i], new_values[j], tolerance))
+
+        def matching(key, j):
+            found = [i for i in index.get(key, []) if close(i, j)]
+            if found:
+                return found
+            for offset in cls.NEIGHBOUR_CELLS:
+                cell = key[:2] + tuple(k + o for k, o in zip(key[2:], offset))
+                found += [i for i in index.get(cell, []) if close(i, j)]
+            return found
+
+        matched = ambiguous = unmatched = new_sources = 0
+        for j, key in enumerate(cls.match_keys(new)):
+            found = matching(key, j)
+            if len(found) == 1:
+                new["is_main"][j] = old["is_main"][found[0]]
+                matched += 1
+            elif found:
+                ambiguous += 1
+                logger.warning(f"{len(found)} sources of the csv match the source at ra={new['ra'][j]}, dec={new['dec'][j]} on {new['date'][j]} ({new['band'][j]}band), is_main is not kept")
+            elif key[:2] in old_groups:
+                unmatched += 1
+                logger.debug(f"No source of the csv matches the source at ra={new['ra'][j]}, dec={new['dec'][j]} on {new['date'][j]} ({new['band'][j]}band)")
+            else:
+                new_sources += 1
+        logger.info(f"Merged is_main data: {matched} matched, {ambiguous} ambiguous, {unmatched} unmatched, {new_sources} in new epochs")
+        profiling.count("merge", sources=len(new), matched=matched)
+        return new_catalog
 
     @classmethod
     def merge_dicts(cls, new_dict, old_dict):
         if old_dict == {}:
             return new_dict
-        for date, bands in new_dict.items():
-            for band, datasources in bands.items():
-                new_sources = []
-                for source in datasources["sources"]:
-                    matching_sources = list(filter(lambda x: cls.are_same(x, source, ["is_main"]), old_dict.get(date, {}).get(band, {}).get("sources", [])))
-                    if len(matching_sources) == 1:
-
-                        source["is_main"] = matching_sources[0].get("is_main", "")
-                    new_sources.append(source)
-                    new_dict[date][band]["sources"] = new_sources
-        return new_dict
-    
+        return cls.merge_catalogs(Catalog.from_dict(new_dict), Catalog.from_dict(old_dict)).to_dict()
+
     @classmethod
-    def folders_and_csv2dict(cls, csvs: list[Path], folders: list[Path]):
+    def dataset2catalog(cls, csv: Path, folder: Path, workers: Optional[int] = None, use_manifest: bool = True) -> Catalog:
+        """Return the catalog of a fit folder, keeping the is_main data of csv if it exists, and save it to csv
+
+        A csv path ending in .npy is stored in the binary format instead. With use_manifest, only the
+        fit files added or modified since the last run are parsed and the csv is left untouched when
+        no fit file changed.
+        """
+        manifest = None
+        if use_manifest:
+            manifest = Manifest.for_csv(csv)
+            fit_files = manifest.scan(folder)
+            for fit_file, rows in zip(fit_files, cls.files2rows(fit_files, workers)):
+                manifest.set_rows(fit_file, rows)
+            if not manifest.changed and csv.exists():
+                logger.info(f"No fit file changed in {folder}, reusing {csv}")
+                manifest.save()
+                return cls.load_catalog(csv)
+            f_catalog = manifest.catalog()
+        else:
+            f_catalog = cls.folder2catalog(folder, workers) # generate catalog from fits txt files
+        if csv.exists(): # if we have an old csv file get the is_main data
+            orig_catalog = cls.load_catalog(csv)
+            f_catalog = cls.merge_catalogs(f_catalog, orig_catalog)
+        cls.save_catalog(f_catalog, csv) # save everything to the csv
+        if manifest:
+            manifest.save() # only once the csv is written, an interrupted run is redone next time
+        return f_catalog
+
+    @classmethod
+    def _dataset2catalog_worker(cls, csv: Path, folder: Path, workers: Optional[int], use_manifest: bool, profile: bool) -> Tuple[Catalog, Optional[dict]]:
+        """dataset2catalog in a worker process, with the profile of its stages for the parent process"""
+        if profile:
+            profiling.enable()
+        f_catalog = cls.dataset2catalog(csv, folder, workers, use_manifest)
+        return f_catalog, profiling.report()["stages"] if profile else None
+
+    @classmethod
+    def folders_and_csv2catalog(cls, csvs: list[Path], folders: list[Path], workers: Optional[int] = None, use_manifest: bool = True):
+        """Yield the catalog of each (csv, fit folder) pair in order, see dataset2catalog
+
+        Several datasets are loaded concurrently, one process each, the parsing workers being shared
+        out between them. A catalog is yielded as soon as it is ready, while the next ones still load.
+        """
         assert len(csvs) == len(folders), "there should be the same amount of fit folders and csv files"
-        for i, csv in enumerate(csvs):
-            folder = folders[i]
-            f_dict = cls.folder2dict(folder) # generate fit_dict from fits txt files
-            if csv.exists(): # if we have an old csv file get the is_main data
-                orig_dict = cls.csv2dict(csv) 
-                f_dict = cls.merge_dicts(f_dict, orig_dict)
-            cls.dict2csv(f_dict, csv) # save everything to the csv
-            yield f_dict
+        if len(csvs) <= 1:
+            for csv, folder in zip(csvs, folders):
+                yield cls.dataset2catalog(csv, folder, workers, use_manifest)
+            return
+        parse_workers = max(1, (workers or os.cpu_count()) // len(csvs))
+        with ProcessPoolExecutor(max_workers=len(csvs)) as executor:
+            futures = [
+                executor.submit(cls._dataset2catalog_worker, csv, folder, parse_workers, use_manifest, profiling.enabled)
+                for csv, folder in zip(csvs, folders)
+            ]
+            for future in futures:
+                f_catalog, stages = future.result()
+                if stages:
+                    profiling.merge(stages)
+                yield f_catalog
+
+    @classmethod
+    def folders_and_csv2dict(cls, csvs: list[Path], folders: list[Path]):
+        for f_catalog in cls.folders_and_csv2catalog(csvs, folders):
+            yield f_catalog.to_dict()
@@ -0,0 +1,79 @@
+import logging
+
+import numpy as np
+
+from .catalog import DTYPE, Catalog, Selection
+
+logger = logging.getLogger()
+
+# one row per (date, band) group, fluxes in catalog.FLUX_UNIT and frequencies in GHz
+STATS_DTYPE = np.dtype([
+    ("date", DTYPE["date"]),
+    ("band", DTYPE["band"]),
+    ("mjd", "f8"),
+    ("freq", "f8"),
+    ("flux", "f8"),
+    ("flux_err", "f8"),
+    ("n", "i8"), # sources in the mean
+])
+
+SPECTRAL_INDEX_DTYPE = np.dtype([
+    ("date", DTYPE["date"]),
+    ("mjd", "f8"),
+    ("alpha", "f8"),
+    ("alpha_err", "f8"),
+])
+
+
+def weighted_means(selection: Selection, main_only: bool = False) -> np.ndarray:
+    """Inverse variance weighted mean flux of each group of a selection (Catalog.query)
+
+    Sources without a positive flux_err are left out, groups without any source get nan. With main_only
+    the mean is taken over the main sources (is_main == 1), giving the main source flux up to rounding.
+    """
+    rows = selection.catalog.rows[selection.indices()]
+    lengths = selection.catalog.stops[selection.groups] - selection.catalog.starts[selection.groups]
+    starts = np.cumsum(lengths) - lengths
+    stats = np.zeros(len(selection), dtype=STATS_DTYPE)
+    if not len(rows):
+        return stats
+
+    err = rows["flux_err"]
+    with np.errstate(divide="ignore"):
+        weights = np.where(err > 0, 1.0 / err**2, 0.0)
+    if main_only:
+        weights[rows["is_main"] != 1] = 0.0
+    # the selection has no empty group, reduceat sums each group
+    weight = np.add.reduceat(weights, starts)
+    weighted_flux = np.add.reduceat(weights * rows["flux"], starts)
+    stats["n"] = np.add.reduceat((weights > 0).astype(np.int64), starts)
+
+    last = starts + lengths - 1 # the last block of a file sets the band data
+    stats["date"] = rows["date"][starts]
+    stats["band"] = rows["band"][starts]
+    stats["mjd"] = selection.mjd
+    stats["freq"] = rows["freq"][last]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        stats["flux"] = np.where(weight > 0, weighted_flux / weight, np.nan)
+        stats["flux_err"] = np.where(weight > 0, 1.0 / np.sqrt(weight), np.nan)
+    return stats
+
+def spectral_index(fit_catalog: Catalog, band1: str, band2: str, main_only: bool = True, start=None, stop=None) -> np.ndarray:
+    """Spectral index alpha (S ~ freq**alpha) between two bands at every date observed in both
+
+    Fluxes are the weighted_means of each band, the error is propagated from their errors.
+    """
+    stats1 = weighted_means(fit_catalog.query(band1, start, stop), main_only)
+    stats2 = weighted_means(fit_catalog.query(band2, start, stop), main_only)
+    _, i1, i2 = np.intersect1d(stats1["date"], stats2["date"], return_indices=True)
+    stats1, stats2 = stats1[i1], stats2[i2]
+
+    result = np.empty(len(stats1), dtype=SPECTRAL_INDEX_DTYPE)
+    result["date"] = stats1["date"]
+    result["mjd"] = stats1["mjd"]
+    with np.errstate(divide="ignore", invalid="ignore"): # negative or missing fluxes give nan
+        log_freq = np.log(stats1["freq"] / stats2["freq"])
+        result["alpha"] = np.log(stats1["flux"] / stats2["flux"]) / log_freq
+        result["alpha_err"] = np.hypot(stats1["flux_err"] / stats1["flux"], stats2["flux_err"] / stats2["flux"]) / np.abs(log_freq)
+    logger.debug(f"Spectral index {band1}/{band2} at {len(result)} dates")
+    return result
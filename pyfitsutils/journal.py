@@ -0,0 +1,86 @@
+import json
+import logging
+import os
+
+from pathlib import Path
+
+import numpy as np
+
+from .catalog import Catalog, to_datetime64
+
+logger = logging.getLogger()
+
+
+class Journal:
+    """Append only journal of the is_main decisions of a getmain session
+
+    Each decision is one json line appended and synced to <catalog>.journal, the catalog itself is only
+    rewritten when the journal is compacted. A journal left by an interrupted session is replayed on the
+    next run.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.pending = 0 # decisions not compacted into the catalog yet
+        self._file = None
+
+    @classmethod
+    def for_catalog(cls, path: Path) -> "Journal":
+        return cls(path.with_name(path.name + ".journal"))
+
+    def record(self, date, band: str, sources: np.ndarray):
+        """Append the decision taken for a (date, band), sources being its rows with is_main set"""
+        main = np.flatnonzero(sources["is_main"] == 1)
+        entry = {
+            "date": str(to_datetime64(date)),
+            "band": band,
+            "n": len(sources),
+            "main": int(main[0]) if len(main) else -1,
+            "ra": float(sources["ra"][main[0]]) if len(main) else None,
+        }
+        if self._file is None:
+            self._file = open(self.path, "a")
+            if self._file.tell() and not self._ends_with_newline():
+                self._file.write("\n") # do not glue this entry to a truncated one
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.pending += 1
+
+    def _ends_with_newline(self) -> bool:
+        with open(self.path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def replay(self, fit_catalog: Catalog) -> set:
+        """Apply the decisions of an existing journal to fit_catalog, return the (date, band) they cover"""
+        decided = set()
+        if not self.path.exists():
+            return decided
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError: # last line of a session killed while writing
+                    logger.warning(f"Ignoring truncated line of {self.path}")
+                    continue
+                date = np.datetime64(entry["date"], "D")
+                sources = fit_catalog.group(date, entry["band"])
+                if sources is None or len(sources) != entry["n"] or (entry["main"] >= 0 and sources["ra"][entry["main"]] != entry["ra"]):
+                    logger.warning(f"Sources of {entry['date']} ({entry['band']}band) changed since they were annotated, ignoring the journal entry")
+                    continue
+                sources["is_main"] = np.arange(len(sources)) == entry["main"]
+                decided.add((date, entry["band"]))
+                self.pending += 1
+        if decided:
+            logger.info(f"Replayed {len(decided)} decisions from {self.path}")
+        return decided
+
+    def clear(self):
+        """Drop the journal, to be called once its decisions are saved in the catalog"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self.path.exists():
+            self.path.unlink()
+        self.pending = 0
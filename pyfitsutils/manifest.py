@@ -0,0 +1,103 @@
+import logging
+
+from pathlib import Path
+
+import numpy as np
+
+from . import catalog
+from .catalog import Catalog
+from .utils import atomic_write, file_hash
+
+logger = logging.getLogger()
+
+
+class Manifest:
+    """Ingestion manifest of a csv: size, mtime and content hash of each fit file, with the rows it produced
+
+    The manifest is saved next to the csv (<csv>.manifest.npz) so later runs only parse new or changed files.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.files = {} # file name -> {"size": ..., "mtime": ..., "hash": ..., "rows": ...}
+        self.changed = False # the catalog differs from the one of the last save
+        self.dirty = False # the manifest itself needs to be saved
+
+    @classmethod
+    def for_csv(cls, csv: Path) -> "Manifest":
+        manifest = cls(csv.with_name(csv.name + ".manifest.npz"))
+        if manifest.path.exists():
+            manifest.load()
+        return manifest
+
+    def load(self):
+        try:
+            with np.load(self.path) as data:
+                rows, file_ids = data["rows"], data["file_ids"]
+                if rows.dtype != catalog.DTYPE:
+                    logger.warning(f"{self.path} was written for another catalog format, ignoring it")
+                    return
+                names = data["names"].tolist()
+                bounds = np.searchsorted(file_ids, np.arange(len(names) + 1)) # rows are saved sorted by file
+                for i, name in enumerate(names):
+                    self.files[name] = {
+                        "size": int(data["sizes"][i]),
+                        "mtime": int(data["mtimes"][i]),
+                        "hash": str(data["hashes"][i]),
+                        "rows": rows[bounds[i]:bounds[i+1]],
+                    }
+        except (OSError, KeyError, ValueError) as e:
+            logger.warning(f"Could not read manifest {self.path} ({e}), every fit file will be parsed")
+            self.files = {}
+
+    def save(self):
+        if not self.dirty and self.path.exists():
+            return
+        names = sorted(self.files)
+        rows = [self.files[name]["rows"] for name in names]
+        with atomic_write(self.path, binary=True) as f: # never leave a half written manifest behind
+            np.savez(
+                f,
+                names=np.array(names, dtype=str),
+                sizes=np.array([self.files[name]["size"] for name in names], dtype=np.int64),
+                mtimes=np.array([self.files[name]["mtime"] for name in names], dtype=np.int64),
+                hashes=np.array([self.files[name]["hash"] for name in names], dtype=str),
+                rows=np.concatenate(rows) if rows else np.empty(0, dtype=catalog.DTYPE),
+                file_ids=np.repeat(np.arange(len(names)), [len(r) for r in rows]),
+            )
+        self.dirty = False
+        logger.info(f"Saved ingestion manifest {self.path}")
+
+    def scan(self, folder: Path) -> list[Path]:
+        """Update the manifest with the content of folder and return the fit files that need to be parsed"""
+        files = {}
+        to_parse = []
+        for fit_file in sorted(folder.iterdir()):
+            stat = fit_file.stat()
+            entry = self.files.get(fit_file.name)
+            if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns:
+                files[fit_file.name] = entry
+                continue
+            digest = file_hash(fit_file)
+            self.dirty = True
+            if entry and entry["hash"] == digest: # touched but not modified
+                files[fit_file.name] = dict(entry, size=stat.st_size, mtime=stat.st_mtime_ns)
+                continue
+            files[fit_file.name] = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "hash": digest, "rows": None}
+            to_parse.append(fit_file)
+
+        deleted = self.files.keys() - files.keys()
+        if deleted:
+            logger.info(f"{len(deleted)} fit files were removed from {folder}")
+        if to_parse:
+            logger.info(f"{len(to_parse)} new or modified fit files in {folder}")
+        self.changed = bool(deleted or to_parse)
+        self.dirty |= self.changed
+        self.files = files
+        return to_parse
+
+    def set_rows(self, fit_file: Path, rows: np.ndarray):
+        self.files[fit_file.name]["rows"] = rows
+
+    def catalog(self) -> Catalog:
+        return Catalog.concatenate(self.files[name]["rows"] for name in sorted(self.files))
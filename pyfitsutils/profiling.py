@@ -0,0 +1,147 @@
+import contextlib
+import cProfile
+import functools
+import io
+import json
+import logging
+import pstats
+import time
+
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger()
+
+# off by default, span() and count() then do nothing but a test of this flag
+enabled = False
+
+class Stage:
+    """Time spent in a stage of a run, with counters of what it processed (files, sources, bytes...)"""
+
+    __slots__ = ("calls", "seconds", "counters")
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.counters = {}
+
+    def add(self, counters: dict):
+        for key, value in counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+
+_stages: dict[str, Stage] = {}
+_start = 0.0
+_cprofile_stage: Optional[str] = None
+_cprofile: Optional[cProfile.Profile] = None
+_cprofile_active = False
+_NULL = contextlib.nullcontext()
+
+def enable(cprofile_stage: Optional[str] = None):
+    """Start recording spans, every call of cprofile_stage is also run under cProfile"""
+    global enabled, _start, _cprofile_stage, _cprofile
+    enabled = True
+    _stages.clear()
+    _start = time.perf_counter()
+    _cprofile_stage = cprofile_stage
+    _cprofile = cProfile.Profile() if cprofile_stage else None
+
+class _Span:
+
+    __slots__ = ("stage", "counters", "profile", "start")
+
+    def __init__(self, name: str, counters: dict):
+        self.stage = _stages.setdefault(name, Stage())
+        self.counters = counters
+        self.profile = False
+
+    def __enter__(self):
+        global _cprofile_active
+        # a nested call of the profiled stage is already measured by the outer one
+        if self.stage is _stages.get(_cprofile_stage) and not _cprofile_active:
+            self.profile = _cprofile_active = True
+            _cprofile.enable()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        global _cprofile_active
+        self.stage.seconds += time.perf_counter() - self.start
+        if self.profile:
+            _cprofile.disable()
+            _cprofile_active = False
+        self.stage.calls += 1
+        self.stage.add(self.counters)
+        return False
+
+def span(name: str, **counters):
+    """Context manager timing a stage, counters are added to the stage when it exits"""
+    if not enabled:
+        return _NULL
+    return _Span(name, counters)
+
+def timed(name: str):
+    """Decorator running every call of the function in a span, its counters are added with count()"""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            with _Span(name, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def count(name: str, **counters):
+    """Add counters to a stage, for what is only known inside or after its span"""
+    if enabled:
+        _stages.setdefault(name, Stage()).add(counters)
+
+def merge(stages: dict):
+    """Add the stages of the report() of another process, their time overlaps the one of this process"""
+    if not enabled:
+        return
+    for name, data in stages.items():
+        stage = _stages.setdefault(name, Stage())
+        stage.calls += data["calls"]
+        stage.seconds += data["seconds"]
+        stage.add({key: value for key, value in data.items() if key not in ("calls", "seconds")})
+
+def report() -> dict:
+    """Return the recorded stages, ready to be dumped as json"""
+    return {
+        "wall_seconds": time.perf_counter() - _start,
+        "stages": {
+            name: {"calls": stage.calls, "seconds": stage.seconds, **stage.counters}
+            for name, stage in _stages.items()
+        },
+    }
+
+def summary(top: int = 20) -> str:
+    """Human readable table of the stages, followed by the slowest functions of the cProfile stage"""
+    data = report()
+    wall = data["wall_seconds"]
+    lines = [f"Profile of the run ({wall:.3f}s):", f"{'stage':16s} {'calls':>7s} {'seconds':>10s} {'%':>6s}  counters"]
+    for name, stage in sorted(data["stages"].items(), key=lambda item: -item[1]["seconds"]):
+        counters = {key: value for key, value in stage.items() if key not in ("calls", "seconds")}
+        rates = ", ".join(
+            f"{key}={value}" + (f" ({value / stage['seconds']:.0f}/s)" if stage["seconds"] > 0 else "")
+            for key, value in counters.items()
+        )
+        lines.append(f"{name:16s} {stage['calls']:7d} {stage['seconds']:10.3f} {100 * stage['seconds'] / wall if wall else 0:6.1f}  {rates}")
+    if _cprofile is not None and _cprofile_stage in _stages:
+        stream = io.StringIO()
+        pstats.Stats(_cprofile, stream=stream).sort_stats("cumulative").print_stats(top)
+        lines.append(f"cProfile of {_cprofile_stage}:")
+        lines.append(stream.getvalue().strip())
+    return "\n".join(lines)
+
+def save(path: Path):
+    """Write the report as json to path, and the cProfile stats next to it (path with a .prof suffix)"""
+    data = report()
+    if _cprofile is not None and _cprofile_stage in _stages:
+        prof = path.with_suffix(".prof")
+        _cprofile.dump_stats(prof)
+        data["cprofile"] = {"stage": _cprofile_stage, "stats": prof.as_posix()}
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2)
+    logger.info(f"Profile saved to {path}")
@@ -1,3 +1,5 @@
+from pathlib import Path
+
 from astropy.coordinates import Angle
 LIST_DICT_SHEET = []
 DICT_RADIUS = {"Lband" : 0.003, "Cband" : 0.0025, "Xband" : 0.002, "Kuband" : 0.0015, "Kband" : 0.001}
@@ -17,4 +19,13 @@ TARGET = {
 }
 
 CONTOUR_COEFS = [3, 5, 10, 20, 30]
+# contour paths computed once per (image, levels, region) are kept here, oldest used removed above the max size
+CONTOUR_CACHE = Path.home() / ".cache" / "pyfitsutils" / "contours"
+CONTOUR_CACHE_MAX_SIZE = 256 * 2**20
+# same for the windows of the images around the target that are rendered
+CUTOUT_CACHE = Path.home() / ".cache" / "pyfitsutils" / "cutouts"
+CUTOUT_CACHE_MAX_SIZE = 1024 * 2**20
+# downsampled levels of the images, used by the preview rendering
+PREVIEW_CACHE = Path.home() / ".cache" / "pyfitsutils" / "previews"
+PREVIEW_CACHE_MAX_SIZE = 1024 * 2**20
 COLORS = ["magenta", "green", "red", "blue"]
\ No newline at end of file
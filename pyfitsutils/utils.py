@@ -1,6 +1,105 @@
-from astropy.coordinates import Angle
+import contextlib
+import hashlib
+import os
+import secrets
+
+from pathlib import Path
+from typing import IO, Iterator, Optional, Tuple
+
 import numpy as np
 
+def to_deg(value) -> float:
+    """Return value in degrees, value being either an Angle or a float already in degrees"""
+    return value.deg if hasattr(value, "deg") else float(value)
+
+# same factor as Angle uses (u.hourangle.to(u.deg)), parsed values agree with the ones astropy gives to the last ulp
+HOURANGLE2DEG = 14.999999999999998
+# and its inverse (u.deg.to(u.hourangle)), used by Angle.to_string(unit="hourangle")
+DEG2HOURANGLE = 0.06666666666666668
+
+def sexagesimal2deg(value: str, hourangle: bool = False) -> float:
+    """Convert "dd:mm:ss.s" (or "hh:mm:ss.s" if hourangle) to degrees without building an Angle"""
+    d, m, s = value.split(":")
+    deg = abs(float(d)) + float(m) / 60.0 + float(s) / 3600.0
+    if d.lstrip().startswith("-"):
+        deg = -deg
+    return deg * HOURANGLE2DEG if hourangle else deg
+
+# smallest fraction of second written by deg2sexagesimal_batch, the default precision of Angle.to_string
+SEXAGESIMAL_PRECISION = 8
+
+def sexagesimal2deg_batch(values: list[str], hourangle: bool = False) -> np.ndarray:
+    """Vectorized sexagesimal2deg, also accepts "mm:ss.s" and "ss.s" (errors written without the leading zeros)"""
+    # right align the fields on 3 columns and let numpy parse them all at once
+    text = ":".join("0:" * (2 - value.count(":")) + value for value in values)
+    fields = np.fromstring(text, dtype=float, sep=":").reshape(-1, 3) if values else np.empty((0, 3))
+    deg = np.abs(fields[:, 0]) + fields[:, 1] / 60.0 + fields[:, 2] / 3600.0
+    negative = np.array([value.lstrip().startswith("-") for value in values], dtype=bool)
+    deg[negative] = -deg[negative]
+    return deg * HOURANGLE2DEG if hourangle else deg
+
+def deg2sexagesimal_batch(values: np.ndarray, hourangle: bool = False) -> list[str]:
+    """Format degrees as "dd:mm:ss.s" (or "hh:mm:ss.s" if hourangle), the format of Angle.to_string(sep=":")
+
+    The last digit of the seconds can differ from astropy by one, astropy rounds at another step of
+    the conversion. Seconds are rounded to SEXAGESIMAL_PRECISION decimals, parsing the result with
+    sexagesimal2deg_batch gives back the value within 0.5e-8 s (plus the float rounding). The strings
+    are stable: formatting the parsed values gives the same strings again, so rewriting a catalog does
+    not change it.
+    """
+    a = np.asarray(values, dtype=float)
+    if hourangle:
+        a = a * DEG2HOURANGLE
+    negative = np.signbit(a)
+    fraction, d = np.modf(np.fabs(a))
+    fraction, m = np.modf(fraction * 60.0)
+    s = fraction * 60.0
+    # carry the seconds that round up to 60
+    carry = s >= 60.0 - 10.0**-SEXAGESIMAL_PRECISION
+    s[carry] = 0.0
+    m[carry] += 1.0
+    carry = m >= 60.0
+    m[carry] = 0.0
+    d[carry] += 1.0
+
+    strings = []
+    for neg, d, m, s in zip(negative.tolist(), d.tolist(), m.tolist(), s.tolist()):
+        seconds = f"{s:.{SEXAGESIMAL_PRECISION}f}".rstrip("0").rstrip(".")
+        if len(seconds) == 1 or seconds[1] == ".":
+            seconds = "0" + seconds
+        strings.append(f"{'-' if neg else ''}{d:.0f}:{int(m):02d}:{seconds}")
+    return strings
+
+def file_hash(path: Path) -> str:
+    """Hash of the content of a file"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+@contextlib.contextmanager
+def atomic_write(path: Path, binary: bool = False) -> Iterator[IO]:
+    """Write path through a temporary file next to it, which replaces path only once the block succeeds
+
+    The temporary name is unique, so processes writing the same path concurrently never share it, and
+    it is removed if the block fails: path is never left half written.
+    """
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.{secrets.token_hex(4)}.tmp")
+    try:
+        with open(tmp, "wb" if binary else "w") as f: # astropy only writes to files opened in the usual modes
+            yield f
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+def image_epoch(name: str) -> Optional[Tuple[str, str]]:
+    """(date, band) of an image name like 07jun1999_Lband_robust0.fits, None for other files"""
+    date, _, rest = name.partition("_")
+    band, sep, _ = rest.partition("band_")
+    return (date, band) if sep else None
+
 def convert_dec(dec: str):
     return dec.replace(".", ":", dec.count(".") -1).replace("-0", "-")
 
@@ -27,10 +126,58 @@ def angsep(ra1,err_ra1,dec1,err_dec1,ra2,err_ra2,dec2,err_dec2):
     #return(angsep_deg,str.zfill(str(dd),2)+":"+str.zfill(str(mm),2)+":"+str.zfill(str(ss),2),err_angsep_deg,str.zfill(str(de),2)+":"+str.zfill(str(me),2)+":"+str.zfill(str(se),2))
     
     # fonction renvoie juste angsep en arcsec puis erreur en arcsec, c'est ça dont je me sers
+    from astropy.coordinates import Angle
     return(Angle(angsep, "rad"),Angle(err_angsep,"rad"))
 
 def rasep(ra1,err_ra1,ra2,err_ra2):
 
     res = ra1.deg - ra2.deg
     error = np.sqrt(err_ra1**2 + err_ra2**2)
-    return(Angle(res, "deg"),Angle(error,"deg"))
\ No newline at end of file
+    from astropy.coordinates import Angle
+    return(Angle(res, "deg"),Angle(error,"deg"))
+
+def radians(source) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Return (ra, ra_err, dec, dec_err) in radians for settings.TARGET, a catalog row or a catalog selection"""
+    return tuple(
+        source[key].rad if hasattr(source[key], "rad") else np.radians(source[key])
+        for key in ("ra", "ra_err", "dec", "dec_err")
+    )
+
+def angsep_batch(ra1, err_ra1, dec1, err_dec1, ra2, err_ra2, dec2, err_dec2) -> Tuple[np.ndarray, np.ndarray]:
+    """Vectorized angsep, every argument is an array (or a scalar) in radians and the result is
+    (separation, error) in radians. Arguments are broadcast, giving a scalar main source computes
+    the separations of all the other sources against it.
+
+    The separation uses the Vincenty formula and the error terms are written without the
+    cancellations of the arccos form, so both stay precise down to zero separation.
+    """
+    dra = ra1 - ra2
+    sin_dra, cos_dra = np.sin(dra), np.cos(dra)
+    sin_dec1, cos_dec1 = np.sin(dec1), np.cos(dec1)
+    sin_dec2, cos_dec2 = np.sin(dec2), np.cos(dec2)
+    hav_dra = 2 * np.sin(dra / 2)**2 # 1 - cos(dra)
+
+    # cross and dot products of the two unit vectors
+    cross_x = cos_dec2 * sin_dra
+    cross_y = np.sin(dec2 - dec1) + sin_dec1 * cos_dec2 * hav_dra # cos_dec1*sin_dec2 - sin_dec1*cos_dec2*cos_dra
+    sin_sep = np.hypot(cross_x, cross_y)
+    cos_sep = sin_dec1 * sin_dec2 + cos_dec1 * cos_dec2 * cos_dra
+    sep = np.arctan2(sin_sep, cos_sep)
+
+    # derivatives of cos(sep), as in angsep
+    term_ra = cos_dec1 * cos_dec2 * sin_dra
+    term_dec1 = -cross_y
+    term_dec2 = np.sin(dec1 - dec2) + cos_dec1 * sin_dec2 * hav_dra # sin_dec1*cos_dec2 - cos_dec1*sin_dec2*cos_dra
+    var = (err_ra1 * term_ra)**2 + (err_dec1 * term_dec1)**2 + (err_ra2 * term_ra)**2 + (err_dec2 * term_dec2)**2
+    # the derivative is undefined for identical positions, fall back on the positional errors
+    var_zero = (err_ra1 * cos_dec1)**2 + err_dec1**2 + (err_ra2 * cos_dec2)**2 + err_dec2**2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        err = np.where(sin_sep > 0, np.sqrt(var) / sin_sep, np.sqrt(var_zero))
+    return sep, err
+
+def rasep_batch(ra1, err_ra1, ra2, err_ra2) -> Tuple[np.ndarray, np.ndarray]:
+    """Vectorized rasep, arguments are arrays (or scalars) in radians and are broadcast"""
+    return np.subtract(ra1, ra2), np.hypot(err_ra1, err_ra2)
+
+def arcsec(rad):
+    return np.degrees(rad) * 3600
@@ -0,0 +1,170 @@
+import logging
+import os
+import time
+
+from pathlib import Path
+from typing import Optional
+
+from . import settings, utils
+from .catalog import Catalog
+from .fits import Fit
+
+logger = logging.getLogger()
+
+
+def snapshot(folder: Path) -> dict[str, tuple[int, int]]:
+    """Return the (size, mtime) of every file of folder by name"""
+    with os.scandir(folder) as entries:
+        return {entry.name: (entry.stat().st_size, entry.stat().st_mtime_ns) for entry in entries if entry.is_file()}
+
+def changed_names(old: dict, new: dict) -> set[str]:
+    """Names of the files added or modified between two snapshots"""
+    return {name for name, state in new.items() if old.get(name) != state}
+
+
+class Folder:
+    """Polled folder, changes are reported once the folder has been quiet for debounce seconds
+
+    A file still being written keeps changing size or mtime, waiting for a quiet period avoids
+    parsing or drawing it half written.
+    """
+
+    def __init__(self, path: Path, debounce: float):
+        self.path = path
+        self.debounce = debounce
+        self.processed = snapshot(path) # state the outputs are up to date with
+        self.last = self.processed
+        self.last_change = time.monotonic()
+
+    def poll(self) -> Optional[tuple[set[str], set[str]]]:
+        """Return the (changed, removed) names once they settled, None while nothing new settled"""
+        current = snapshot(self.path)
+        now = time.monotonic()
+        if current != self.last:
+            self.last, self.last_change = current, now
+            return None
+        if current == self.processed or now - self.last_change < self.debounce:
+            return None
+        changed = changed_names(self.processed, current)
+        removed = self.processed.keys() - current.keys()
+        self.processed = current
+        return changed, removed
+
+
+class Watcher:
+    """Keep the catalogs and figures of datasets up to date with their fit and images folders
+
+    New or modified fit files are ingested with the manifest (only they are parsed, is_main is kept),
+    then only the figures of the epochs they or new images belong to are drawn again, along with the
+    time series of their bands. series are (metric, band, strategy) of draw.draw_series.
+    """
+
+    def __init__(self, csvs: list[Path], fitsfolders: list[Path], imagesfolders: list[Path], rms_csvs: list[Path], output: Path,
+                 fit_catalogs: list[Catalog], contours=False, drawband=None, draw_epochs=True, series=(), maxdate=None, listdate=None,
+                 workers=None, interval=2.0, debounce=1.0):
+        self.csvs = csvs
+        self.fitsfolders = [Folder(folder, debounce) for folder in fitsfolders]
+        self.imagesfolders = [Folder(folder, debounce) for folder in imagesfolders]
+        self.rms_csvs = rms_csvs or []
+        self.rms_mtimes = self.mtimes(self.rms_csvs)
+        self.output = output
+        self.fit_catalogs = list(fit_catalogs)
+        self.contours = contours
+        self.drawband = drawband
+        self.draw_epochs = draw_epochs
+        self.series = list(series)
+        self.maxdate = maxdate
+        self.listdate = listdate
+        self.workers = workers
+        self.interval = interval
+
+    @staticmethod
+    def mtimes(paths: list[Path]) -> list[int]:
+        return [path.stat().st_mtime_ns for path in paths]
+
+    def run(self):
+        """Poll the folders every interval seconds until interrupted"""
+        import matplotlib.pyplot as plt
+        plt.switch_backend("Agg") # figures are only saved, draw_series would block on plt.show otherwise
+        logger.info(f"Watching {len(self.fitsfolders)} fit folders and {len(self.imagesfolders)} images folders, Ctrl+C to stop")
+        try:
+            while True:
+                self.poll()
+                time.sleep(self.interval)
+        except KeyboardInterrupt:
+            logger.info("Stopped watching")
+
+    def poll(self) -> list[tuple[int, str, str]]:
+        """Ingest and draw what changed since the last poll, return the (dataset, date, band) drawn again"""
+        rms_mtimes = self.mtimes(self.rms_csvs)
+        if rms_mtimes != self.rms_mtimes: # new dates in the sheet
+            from . import draw
+            logger.info("rms csv changed, reloading it")
+            settings.LIST_DICT_SHEET.clear()
+            draw.init(self.rms_csvs)
+            self.rms_mtimes = rms_mtimes
+
+        epochs = set()
+        bands = set()
+        for i, (fitsfolder, imagesfolder) in enumerate(zip(self.fitsfolders, self.imagesfolders)):
+            fits_changes = fitsfolder.poll()
+            if fits_changes:
+                changed, removed = fits_changes
+                logger.info(f"{len(changed)} new or modified and {len(removed)} removed fit files in {fitsfolder.path}")
+                self.fit_catalogs[i] = next(Fit.folders_and_csv2catalog([self.csvs[i]], [fitsfolder.path], self.workers))
+                for name in changed | removed:
+                    try:
+                        date, band = Fit.file_metadata(fitsfolder.path / name)
+                    except AttributeError: # not a fit file
+                        continue
+                    bands.add(band)
+                    if name in changed:
+                        epochs.add((i, date.strftime('%d%b%Y').lower(), band))
+            images_changes = imagesfolder.poll()
+            if images_changes:
+                changed, _ = images_changes
+                logger.info(f"{len(changed)} new or modified images in {imagesfolder.path}")
+                epochs.update((i, *epoch) for epoch in map(utils.image_epoch, changed) if epoch)
+
+        drawn = self.draw_epochs_of(epochs) if self.draw_epochs else []
+        for metric, band, strategy in self.series:
+            if band in bands:
+                self.draw_series(metric, band, strategy)
+        return drawn
+
+    def draw_epochs_of(self, epochs: set[tuple[int, str, str]]) -> list[tuple[int, str, str]]:
+        """Draw and save the figure of each (dataset, date, band) found in its catalog"""
+        from . import draw
+        import matplotlib.pyplot as plt
+
+        drawn = []
+        for i, fit_catalog in enumerate(self.fit_catalogs):
+            wanted = {(date, band) for j, date, band in epochs if j == i and band == (self.drawband or band)}
+            if not wanted:
+                continue
+            for date, band, sources in fit_catalog.query(self.drawband or None):
+                if (date.strftime('%d%b%Y').lower(), band) not in wanted:
+                    continue
+                try:
+                    fig = draw.draw_sources(date, band, sources, self.imagesfolders[i].path, self.output, self.contours, True, i)
+                except Exception:
+                    logger.exception(f"Could not draw {date:%Y-%m-%d} {band} of dataset {i}")
+                    continue
+                if fig:
+                    plt.close(fig)
+                    drawn.append((i, date.strftime('%Y-%m-%d'), band))
+        if drawn:
+            logger.info(f"Drew {len(drawn)} figures again: {', '.join(f'{date} {band}' for _, date, band in drawn)}")
+        return drawn
+
+    def draw_series(self, metric: str, band: str, strategy: str):
+        from . import draw
+        import matplotlib.pyplot as plt
+
+        try:
+            draw.draw_series(self.fit_catalogs, band, metric, self.output, strategy, self.maxdate, self.listdate)
+        except Exception:
+            logger.exception(f"Could not draw the {metric} of {band}band")
+        else:
+            logger.info(f"Drew the {metric} of {band}band again")
+        plt.close("all") # draw_series always draws on figure 1
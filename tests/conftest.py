@@ -0,0 +1,30 @@
+import pytest
+
+# two components 1 arcsec apart near the target, in the format Fit.block2source_dict parses
+FIT_TEXT = """header
+Fit on XTE component 0
+--- ra: 17:48:05.05300 +/- 0.00050 s
+--- ra: 512.0 +/- 0.1 pixels
+--- dec: -28.28.25.8500 +/- 0.0050 arcsec
+--- dec: 512.0 +/- 0.1 pixels
+Clean beam size ---
+--- major axis FWHM: 1.000 arcsec
+--- minor axis FWHM: 0.500 arcsec
+--- Integrated: 2.000 +/- 0.100 mJy
+--- frequency: 1.4 GHz
+Fit on XTE component 1
+--- ra: 17:48:05.12800 +/- 0.00050 s
+--- ra: 530.0 +/- 0.1 pixels
+--- dec: -28.28.25.8500 +/- 0.0050 arcsec
+--- dec: 512.0 +/- 0.1 pixels
+Clean beam size ---
+--- major axis FWHM: 1.000 arcsec
+--- minor axis FWHM: 0.500 arcsec
+--- Integrated: 1.000 +/- 0.100 mJy
+--- frequency: 1.4 GHz
+"""
+
+
+@pytest.fixture
+def fit_text() -> str:
+    return FIT_TEXT
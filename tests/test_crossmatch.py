@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from pyfitsutils import crossmatch
+
+EPOCHS = 200
+
+
+def detections(core_x: float, core_y: float, seed: int, jitter=0.05, background=4):
+    """A source at (core_x, core_y) seen at every epoch, over uniform background sources
+
+    Every tolerance is 0.5 arcsec and the background spans [-5, 5], so the grid of tracks() has its
+    cell edges on the multiples of 0.5.
+    """
+    rng = np.random.default_rng(seed)
+    x = np.concatenate([rng.normal(core_x, jitter, EPOCHS), [-5, 5], rng.uniform(-5, 5, EPOCHS * background)])
+    y = np.concatenate([rng.normal(core_y, jitter, EPOCHS), [-5, 5], rng.uniform(-5, 5, EPOCHS * background)])
+    return x, y, np.full(len(x), 0.5)
+
+@pytest.mark.parametrize("seed", range(10))
+@pytest.mark.parametrize("core", [(0, 0.25), (0, 0), (0.25, 0.25)], ids=["edge", "corner", "center"])
+def test_source_is_one_track(core, seed):
+    x, y, tolerance = detections(*core, seed)
+    labels, center_x, center_y = crossmatch.tracks(x, y, tolerance)
+    main = labels[:EPOCHS]
+    assert (main >= 0).all()
+    assert len(np.unique(main)) == 1
+    assert np.hypot(center_x[main[0]] - core[0], center_y[main[0]] - core[1]) < 0.02
+
+def test_merge_seeds_within_tolerance():
+    seed_x = np.array([0.0, 0.1, 3.0, 0.05])
+    seed_y = np.zeros(4)
+    group = crossmatch.merge(seed_x, seed_y, np.array([0.5, 0.5, 0.5, 0.0]))
+    assert group.tolist() == [0, 0, 1, 0]
+
+def test_main_track_is_the_source_at_the_target():
+    x, y, tolerance = detections(0, 0, seed=0)
+    date = (np.arange(len(x)) % EPOCHS).astype("datetime64[D]").astype("datetime64[s]")
+    labels, center_x, center_y = crossmatch.tracks(x, y, tolerance)
+    assert crossmatch.main_track(labels, center_x, center_y, tolerance, date) == labels[0]
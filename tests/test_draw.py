@@ -0,0 +1,16 @@
+import datetime
+
+from pyfitsutils import draw
+
+
+def test_missing_images_folder_is_empty(tmp_path):
+    folder = tmp_path / "not_mounted"
+    assert draw.index_images(folder) == {}
+    groups = [(datetime.datetime(1999, 6, 7), "L", None)]
+    assert draw.check_images(folder, groups) == [(datetime.datetime(1999, 6, 7), "L")]
+    assert draw.load_fits(folder, datetime.datetime(1999, 6, 7), "L") is None
+
+def test_images_indexed_by_date_and_band(tmp_path):
+    (tmp_path / "07jun1999_Lband_robust0.fits").touch()
+    (tmp_path / "notes.txt").touch()
+    assert draw.index_images(tmp_path) == {("07jun1999", "L"): [tmp_path / "07jun1999_Lband_robust0.fits"]}
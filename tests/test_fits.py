@@ -0,0 +1,84 @@
+import math
+import random
+
+import numpy as np
+import pytest
+
+from pyfitsutils import catalog
+from pyfitsutils.catalog import Catalog
+from pyfitsutils.fits import Fit
+
+
+def fit_file(path, components: int, seed: int):
+    """Write a fit file of components with random positions, errors and fluxes in mJy or uJy"""
+    rng = random.Random(seed)
+    blocks = []
+    for k in range(components):
+        blocks.append(
+            f"Fit on XTE component {k}\n"
+            f"--- ra: 17:{rng.randrange(60):02d}:{rng.uniform(0, 60):08.5f} +/- {rng.uniform(0.0001, 0.001):.5f} s\n"
+            f"--- ra: {rng.uniform(0, 1024):.1f} +/- 0.1 pixels\n"
+            f"--- dec: -{rng.randrange(90):02d}.{rng.randrange(60):02d}.{rng.uniform(0, 60):07.4f} +/- {rng.uniform(0.001, 0.01):.4f} arcsec\n"
+            f"--- dec: {rng.uniform(0, 1024):.1f} +/- 0.1 pixels\n"
+            "Clean beam size ---\n"
+            f"--- major axis FWHM: {rng.uniform(1, 2):.3f} arcsec\n"
+            f"--- minor axis FWHM: {rng.uniform(0.5, 1):.3f} arcsec\n"
+            f"--- Integrated: {rng.uniform(0.1, 50):.3f} +/- {rng.uniform(0.01, 1):.3f} {rng.choice('mu')}Jy\n"
+            "--- frequency: 1.4 GHz\n"
+        )
+    path.write_text("header\n" + "".join(blocks))
+    return blocks
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_iter_records_agrees_with_block2source_dict(tmp_path, seed):
+    path = tmp_path / "xte_07jun1999_Lband.txt"
+    blocks = fit_file(path, 200, seed)
+    records = list(Fit.iter_records(path))
+    assert len(records) == len(blocks)
+    for block, record in zip(blocks, records):
+        source_dict, band_dict = Fit.block2source_dict(block.splitlines())
+        _, _, freq, major, minor, ra, ra_err, dec, dec_err, flux, flux_err, _ = record
+        assert (freq, major, minor) == tuple(float(band_dict[key]) for key in ("freq", "major", "minor"))
+        for value, angle in ((ra, source_dict["ra"]), (ra_err, source_dict["ra_err"]),
+                             (dec, source_dict["dec"]), (dec_err, source_dict["dec_err"])):
+            assert abs(value - angle.deg) <= math.ulp(angle.deg)
+        assert (flux, flux_err) == (float(source_dict["flux"]), float(source_dict["flux_err"]))
+
+
+# the csv written by the version before the catalog, is_main set by getmain, for the fit file of fit_text
+BASELINE_CSV = "07Jun1999,L,1.4,1.000,0.500,17:48:05.053,0:00:00.0005,-28:28:25.85,0:00:00.005,2.000,0.100,1,17:48:05.128,0:00:00.0005,-28:28:25.85,0:00:00.005,1.000,0.100,0\n"
+
+
+def test_is_main_is_kept_from_a_baseline_csv(tmp_path, fit_text):
+    folder = tmp_path / "fits"
+    folder.mkdir()
+    (folder / "xte_07jun1999_Lband.txt").write_text(fit_text)
+    csv = tmp_path / "catalog.csv"
+    csv.write_text(BASELINE_CSV)
+    fit_catalog = Fit.dataset2catalog(csv, folder, workers=1)
+    assert fit_catalog.rows["is_main"].tolist() == [1, 0]
+    assert Fit.csv2catalog(csv).rows["is_main"].tolist() == [1, 0]
+
+def test_ambiguous_match_is_not_kept(tmp_path, fit_text):
+    path = tmp_path / "xte_07jun1999_Lband.txt"
+    path.write_text(fit_text)
+    new = Catalog(Fit.file2rows(path))
+    old = Catalog(Fit.file2rows(path)[[0, 0, 1]]) # the first source twice
+    old.rows["is_main"] = [1, 0, 0]
+    assert Fit.merge_catalogs(new, old).rows["is_main"].tolist() == [catalog.UNKNOWN, 0]
+
+def test_convert_round_trip(tmp_path, fit_text):
+    folder = tmp_path / "fits"
+    folder.mkdir()
+    (folder / "xte_07jun1999_Lband.txt").write_text(fit_text)
+    (folder / "xte_08jun1999_Cband.txt").write_text(fit_text.replace("1.4 GHz", "5.0 GHz"))
+    csv, npy, back = tmp_path / "catalog.csv", tmp_path / "catalog.npy", tmp_path / "back.csv"
+    fit_catalog = Fit.dataset2catalog(csv, folder, workers=1, use_manifest=False)
+    fit_catalog.rows["is_main"][0] = 1
+    Fit.save_catalog(fit_catalog, csv)
+
+    Fit.convert(csv, npy)
+    np.testing.assert_array_equal(Fit.load_catalog(npy).rows, Fit.csv2catalog(csv).rows)
+    Fit.convert(npy, back)
+    assert back.read_text() == csv.read_text()
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from pyfitsutils import catalog
+from pyfitsutils.fits import Fit
+from pyfitsutils.journal import Journal
+
+
+@pytest.fixture
+def session(tmp_path, fit_text):
+    """The csv and fit folder of an interrupted getmain session, which chose the second source of both epochs"""
+    folder = tmp_path / "fits"
+    folder.mkdir()
+    for date in ("07jun1999", "08jun1999"):
+        (folder / f"xte_{date}_Lband.txt").write_text(fit_text)
+    csv = tmp_path / "catalog.csv"
+    journal = Journal.for_catalog(csv)
+    for date, band, sources in Fit.dataset2catalog(csv, folder, workers=1).groups():
+        sources["is_main"] = [0, 1]
+        journal.record(date, band, sources)
+    journal._file.close()
+    return csv, folder
+
+def test_truncated_last_line_is_skipped(session):
+    csv, folder = session
+    journal = Journal.for_catalog(csv)
+    with open(journal.path, "a") as f:
+        f.write('{"date": "1999-06-09", "ba')
+    fit_catalog = Fit.dataset2catalog(csv, folder, workers=1)
+    assert len(journal.replay(fit_catalog)) == 2
+    assert fit_catalog.rows["is_main"].tolist() == [0, 1, 0, 1]
+    assert journal.pending == 2
+
+def test_entries_of_changed_sources_are_rejected(session, fit_text):
+    csv, folder = session
+    (folder / "xte_08jun1999_Lband.txt").write_text(fit_text.replace("17:48:05.12800", "17:48:05.12900"))
+    fit_catalog = Fit.dataset2catalog(csv, folder, workers=1)
+    decided = Journal.for_catalog(csv).replay(fit_catalog)
+    assert decided == {(np.datetime64("1999-06-07"), "L")}
+    assert fit_catalog.rows["is_main"].tolist() == [0, 1, catalog.UNKNOWN, catalog.UNKNOWN]
@@ -0,0 +1,57 @@
+import pytest
+
+from pyfitsutils.fits import Fit
+from pyfitsutils.manifest import Manifest
+
+
+@pytest.fixture
+def parsed(monkeypatch):
+    """Names of the fit files parsed, in order"""
+    names = []
+    file2rows = Fit.file2rows
+    def spy(cls, fit_file):
+        names.append(fit_file.name)
+        return file2rows(fit_file)
+    monkeypatch.setattr(Fit, "file2rows", classmethod(spy))
+    return names
+
+@pytest.fixture
+def dataset(tmp_path, fit_text):
+    folder = tmp_path / "fits"
+    folder.mkdir()
+    for date in ("07jun1999", "08jun1999"):
+        (folder / f"xte_{date}_Lband.txt").write_text(fit_text)
+    return tmp_path / "catalog.csv", folder
+
+def test_only_changed_files_are_parsed(dataset, parsed, fit_text):
+    csv, folder = dataset
+    Fit.dataset2catalog(csv, folder, workers=1)
+    assert parsed == ["xte_07jun1999_Lband.txt", "xte_08jun1999_Lband.txt"]
+    parsed.clear()
+    (folder / "xte_08jun1999_Lband.txt").write_text(fit_text.replace("2.000 +/-", "3.000 +/-"))
+    (folder / "xte_09jun1999_Lband.txt").write_text(fit_text)
+    fit_catalog = Fit.dataset2catalog(csv, folder, workers=1)
+    assert parsed == ["xte_08jun1999_Lband.txt", "xte_09jun1999_Lband.txt"]
+    assert len(fit_catalog) == 6
+    assert fit_catalog.rows["flux"].tolist() == [2.0, 1.0, 3.0, 1.0, 2.0, 1.0]
+
+def test_rows_of_deleted_files_are_dropped(dataset):
+    csv, folder = dataset
+    Fit.dataset2catalog(csv, folder, workers=1)
+    (folder / "xte_07jun1999_Lband.txt").unlink()
+    fit_catalog = Fit.dataset2catalog(csv, folder, workers=1)
+    assert fit_catalog.ngroups == 1
+    assert Fit.csv2catalog(csv).ngroups == 1
+    assert list(Manifest.for_csv(csv).files) == ["xte_08jun1999_Lband.txt"]
+
+def test_csv_is_not_rewritten_when_nothing_changed(dataset, parsed):
+    csv, folder = dataset
+    Fit.dataset2catalog(csv, folder, workers=1)
+    parsed.clear()
+    (folder / "xte_07jun1999_Lband.txt").touch() # touched but not modified
+    before = csv.stat()
+    fit_catalog = Fit.dataset2catalog(csv, folder, workers=1)
+    after = csv.stat()
+    assert parsed == []
+    assert (after.st_ino, after.st_mtime_ns) == (before.st_ino, before.st_mtime_ns)
+    assert len(fit_catalog) == 4
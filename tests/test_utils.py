@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from astropy import units as u
+from astropy.io import fits
+from astropy.coordinates import Angle
+
+from pyfitsutils import utils
+
+# one unit of the last digit of the seconds
+LAST_DIGIT = 10.0**-utils.SEXAGESIMAL_PRECISION
+
+
+@pytest.mark.parametrize("hourangle", [True, False], ids=["ra", "dec"])
+def test_deg2sexagesimal_batch_within_a_digit_of_astropy(hourangle):
+    rng = np.random.default_rng(0)
+    values = rng.uniform(0, 360, 3000) if hourangle else rng.uniform(-90, 90, 3000)
+    strings = utils.deg2sexagesimal_batch(values, hourangle)
+    expected = Angle(values, "deg").to_string(unit=u.hourangle if hourangle else u.deg, sep=":")
+    # the seconds of the strings, which may differ in the last digit
+    seconds = utils.sexagesimal2deg_batch(strings) * 3600
+    expected_seconds = utils.sexagesimal2deg_batch(list(expected)) * 3600
+    assert np.all(np.abs(seconds - expected_seconds) <= LAST_DIGIT * 1.01)
+    assert np.mean([s == e for s, e in zip(strings, expected)]) > 0.99
+
+@pytest.mark.parametrize("hourangle", [True, False], ids=["ra", "dec"])
+def test_deg2sexagesimal_batch_is_stable(hourangle):
+    values = np.random.default_rng(1).uniform(0, 360 if hourangle else 90, 3000)
+    strings = utils.deg2sexagesimal_batch(values, hourangle)
+    parsed = utils.sexagesimal2deg_batch(strings, hourangle)
+    assert utils.deg2sexagesimal_batch(parsed, hourangle) == strings
+    assert np.all(np.abs(parsed - values) * 3600 / (15 if hourangle else 1) <= 0.5 * LAST_DIGIT + 1e-9)
+
+@pytest.mark.parametrize("name, epoch", [
+    ("07jun1999_Lband_robust0.fits", ("07jun1999", "L")),
+    ("07jun1999_Kuband_robust0_pb.fits", ("07jun1999", "Ku")),
+    ("rms.csv", None),
+])
+def test_image_epoch(name, epoch):
+    assert utils.image_epoch(name) == epoch
+
+def test_atomic_write(tmp_path):
+    path = tmp_path / "catalog.csv"
+    with utils.atomic_write(path) as f:
+        f.write("first\n")
+    with pytest.raises(RuntimeError):
+        with utils.atomic_write(path) as f:
+            f.write("second\n")
+            raise RuntimeError("interrupted")
+    assert path.read_text() == "first\n"
+    assert list(tmp_path.iterdir()) == [path]
+
+def test_atomic_write_takes_fits_files(tmp_path):
+    path = tmp_path / "image.fits"
+    with utils.atomic_write(path, binary=True) as f:
+        fits.PrimaryHDU(np.ones((4, 4))).writeto(f)
+    assert fits.getdata(path).sum() == 16
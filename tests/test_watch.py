@@ -0,0 +1,27 @@
+import matplotlib
+
+matplotlib.use("Agg")
+
+from pyfitsutils import catalog
+from pyfitsutils.fits import Fit
+from pyfitsutils.watch import Watcher
+
+
+def test_new_fit_file_draws_the_series_again(tmp_path, fit_text):
+    fits_folder, images_folder, output = tmp_path / "fits", tmp_path / "images", tmp_path / "output"
+    for folder in (fits_folder, images_folder, output):
+        folder.mkdir()
+    csv = tmp_path / "catalog.csv"
+    (fits_folder / "xte_07jun1999_Lband.txt").write_text(fit_text)
+    fit_catalog = Fit.dataset2catalog(csv, fits_folder, workers=1)
+    fit_catalog.rows["is_main"] = [1, 0]
+    Fit.save_catalog(fit_catalog, csv)
+
+    watcher = Watcher([csv], [fits_folder], [images_folder], [], output, [fit_catalog], draw_epochs=False,
+                      series=[("angsep", "L", "is_main")], workers=1, debounce=0)
+    (fits_folder / "xte_08jun1999_Lband.txt").write_text(fit_text)
+    watcher.poll() # the change is seen
+    watcher.poll() # and settled
+
+    assert (watcher.fit_catalogs[0].rows["is_main"] == catalog.UNKNOWN).sum() == 2 # the new epoch
+    assert list(output.glob("angsep_L_*.jpg"))